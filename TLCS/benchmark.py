@@ -0,0 +1,152 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import subprocess
+import timeit
+import numpy as np
+
+# cold start budget in seconds of every entry point: time to import the module in a fresh interpreter,
+# before SUMO is started. testing and fixed-time runs must not pull in tensorflow or matplotlib
+STARTUP_BUDGETS = {
+    'training_main': 1.5,
+    'testing_main': 1.0,
+    'fixedtime_testing': 1.0,
+}
+
+
+def startup(repeats=5):
+    """
+    Measure the cold start time of every entry point and compare it with its budget
+    """
+    print("%-20s %10s %10s %8s" % ('Entry point', 'Median (s)', 'Budget (s)', 'Status'))
+    over_budget = False
+    for module_name, budget in STARTUP_BUDGETS.items():
+        timings = []
+        for _ in range(repeats):
+            start_time = timeit.default_timer()
+            subprocess.run([sys.executable, "-c", "import " + module_name], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            timings.append(timeit.default_timer() - start_time)
+        median = np.median(timings)
+        status = 'ok' if median <= budget else 'OVER'
+        over_budget = over_budget or median > budget
+        print("%-20s %10.2f %10.2f %8s" % (module_name, median, budget, status))
+    return over_budget
+
+
+def sparse_input(occupancies=(0.05, 0.1, 0.2, 0.4), num_layers=4, width=400, batch_size=100, repeats=200):
+    """
+    Throughput of the dense and of the sparse (embedding bag) first layer at several occupancy levels of the state:
+    numpy predict_one and predict_batch of the test model, keras train_batch of the training model
+    """
+    from model import TrainModel, forward, extract_weights
+
+    rng = np.random.default_rng(0)
+    Dense = TrainModel(num_layers, width, batch_size, 0.001, input_dim=80, output_dim=4)
+    Sparse = TrainModel(num_layers, width, batch_size, 0.001, input_dim=80, output_dim=4, sparse_input=True)
+    weights = extract_weights(Dense._model)
+
+    def states_per_second(function, n_states, n_repeats):
+        function()  # warm up
+        start_time = timeit.default_timer()
+        for _ in range(n_repeats):
+            function()
+        return n_states * n_repeats / (timeit.default_timer() - start_time)
+
+    print("%10s %14s %14s %14s %14s %14s %14s" % ('Occupancy', 'one dense/s', 'one sparse/s', 'batch dense/s', 'batch sparse/s', 'train dense/s', 'train sparse/s'))
+    for occupancy in occupancies:
+        states = (rng.random((batch_size, 80)) < occupancy).astype(np.float32)
+        q_sa = rng.random((batch_size, 4)).astype(np.float32)
+        state = states[:1]
+        print("%10.2f %14.0f %14.0f %14.0f %14.0f %14.0f %14.0f" % (
+            occupancy,
+            states_per_second(lambda: forward(weights, state), 1, repeats * 10),
+            states_per_second(lambda: forward(weights, state, sparse_input=True), 1, repeats * 10),
+            states_per_second(lambda: forward(weights, states), batch_size, repeats),
+            states_per_second(lambda: forward(weights, states, sparse_input=True), batch_size, repeats),
+            states_per_second(lambda: Dense.train_batch(states, q_sa), batch_size, repeats // 10),
+            states_per_second(lambda: Sparse.train_batch(states, q_sa), batch_size, repeats // 10)))
+    return False
+
+
+def state_encoder(demands=(1800, 6000), max_steps=3600, decision_interval=5, seed=10000):
+    """
+    Equivalence and cost of the detector state encoder against the per-vehicle one: both states are built at regular
+    steps of one episode per demand, under the signal program of the network. Fails if any state differs
+    """
+    import traci
+    from generator import TrafficGenerator
+    from detectors import DetectorStateEncoder, DETECTORS_FILE
+    from testing_simulation import Simulation
+    from utils import set_sumo
+
+    Encoder = DetectorStateEncoder(80, os.path.join('intersection', 'simubaneswor.sumocfg'))
+    print("%8s %10s %10s %12s %14s %14s" % ('Cars', 'States', 'Different', 'Avg in net', 'Vehicles (ms)', 'Detectors (ms)'))
+    mismatches = 0
+    for n_cars in demands:
+        TrafficGen = TrafficGenerator(max_steps, n_cars, route_file=os.path.join('intersection', 'benchmark_routes.rou.xml'))
+        TrafficGen.generate_routefile(seed)
+        traci.start(set_sumo(False, 'simubaneswor.sumocfg', max_steps, 'benchmark_routes.rou.xml', additional_files=[DETECTORS_FILE]))
+        Encoder.subscribe()
+        Vehicles = Simulation(None, TrafficGen, None, max_steps, 0, 0, 80, 4)  # only used for its per-vehicle _get_state
+
+        n_states, n_different, in_network, vehicle_time, detector_time = 0, 0, 0, 0.0, 0.0
+        for step in range(decision_interval, max_steps, decision_interval):
+            traci.simulationStep(step)
+            start_time = timeit.default_timer()
+            vehicle_state = Vehicles._get_state()
+            vehicle_time += timeit.default_timer() - start_time
+            start_time = timeit.default_timer()
+            detector_state = Encoder.get_state()
+            detector_time += timeit.default_timer() - start_time
+            n_states += 1
+            n_different += int(not np.array_equal(vehicle_state, detector_state))
+            in_network += traci.vehicle.getIDCount()
+        traci.close()
+
+        mismatches += n_different
+        print("%8i %10i %10i %12.1f %14.3f %14.3f" % (n_cars, n_states, n_different, in_network / n_states,
+                                                     vehicle_time / n_states * 1000, detector_time / n_states * 1000))
+    return mismatches > 0
+
+
+def replay(memory_size=5000, training_epochs=800, num_layers=4, width=400, batch_size=100, gamma=0.75):
+    """
+    Training throughput of one episode of replay with the two replay modes, on the same random memory:
+    per_batch (predict_batch twice and train_batch for every batch) and dataset (one tf.data pass)
+    """
+    from model import TrainModel
+    from memory import Memory
+    from training_simulation import Simulation
+
+    rng = np.random.default_rng(0)
+    ReplayMemory = Memory(memory_size, 0)
+    for _ in range(memory_size):
+        ReplayMemory.add_sample(((rng.random(80) < 0.2).astype(float), rng.integers(4), -rng.random() * 100, (rng.random(80) < 0.2).astype(float)))
+
+    print("%10s %10s %12s %12s" % ('Mode', 'Samples', 'Time (s)', 'Samples/s'))
+    for replay_mode in ('per_batch', 'dataset'):
+        Model = TrainModel(num_layers, width, batch_size, 0.001, input_dim=80, output_dim=4)
+        Replay = Simulation(Model, ReplayMemory, None, None, gamma, 0, 0, 0, 80, 4, training_epochs, replay_mode=replay_mode)
+        start_time = timeit.default_timer()
+        _, n_samples, _ = Replay._replay_batches(training_epochs)
+        elapsed = timeit.default_timer() - start_time
+        print("%10s %10i %12.2f %12.0f" % (replay_mode, n_samples, elapsed, n_samples / elapsed))
+    return False
+
+
+BENCHMARKS = {
+    'startup': startup,
+    'sparse_input': sparse_input,
+    'state_encoder': state_encoder,
+    'replay': replay,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        sys.exit("usage: python benchmark.py {%s}" % ",".join(BENCHMARKS))
+
+    failed = BENCHMARKS[sys.argv[1]]()
+    sys.exit(1 if failed else 0)
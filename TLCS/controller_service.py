@@ -0,0 +1,274 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import json
+import socket
+import signal
+import asyncio
+import argparse
+import time
+from collections import deque
+import numpy as np
+
+from model import TestModel, DistilledModel
+from utils import import_test_configuration
+
+# protocol: one json message per line over a local TCP socket
+#   request:  {"junction": "J1", "state": [80 cell occupancies]}  ->  {"junction": "J1", "action": 2, "q_values": [...], "latency_ms": 0.4}
+#   request:  {"type": "stats"}                                   ->  latency percentiles and batch sizes of the service
+#   a malformed request or a state of the wrong length gets {"error": "..."} and the connection stays open
+
+
+def latency_stats(latencies):
+    """
+    Count and percentiles of a list of latencies in milliseconds
+    """
+    if not latencies:
+        return {'requests': 0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'requests': len(latencies), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': max(latencies)}
+
+
+class ControllerService:
+    def __init__(self, Model, max_batch=32, max_wait_ms=1.0, budget_ms=10.0, window=100000):
+        self._Model = Model
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000  # how long the first request of a batch waits for others
+        self._budget = budget_ms
+        self._queue = None
+        self._latencies = deque(maxlen=window)  # service latency of the last requests, in ms
+        self._batch_sizes = deque(maxlen=window)
+        self._over_budget = 0
+        self._errors = 0  # malformed requests and failed forward passes
+        self._connections = 0
+
+
+    async def serve(self, host, port):
+        """
+        Keep the model warm and serve the junctions until cancelled
+        """
+        self._queue = asyncio.Queue()
+        self._Model.predict_batch(np.zeros((1, self._Model.input_dim)))  # first call outside of the latency budget
+        batcher = asyncio.ensure_future(self._batcher())
+        server = await asyncio.start_server(self._handle, host, port)
+        print('Controller service listening on %s:%i (max batch %i, max wait %.1f ms, budget %.1f ms)' % (
+            host, port, self._max_batch, self._max_wait * 1000, self._budget))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+    async def _handle(self, reader, writer):
+        """
+        One connection per junction controller: its requests are answered in order, the ones of several junctions are batched
+        """
+        self._connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self._reply(line)
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass  # the junction went away
+        finally:
+            self._connections -= 1  # always: the batcher stops waiting once every connected junction has a request in
+            writer.close()
+
+
+    async def _reply(self, line):
+        """
+        Reply to one message: the action values of a state, the stats, or an error for a malformed request
+        """
+        try:
+            message = json.loads(line)
+            if message.get('type') == 'stats':
+                return self.stats()
+            state = np.asarray(message['state'], dtype=np.float32)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self._errors += 1
+            return {'error': 'malformed request, expected {"junction": ..., "state": [...]}'}
+        if state.shape != (self._Model.input_dim,):
+            self._errors += 1
+            return {'junction': message.get('junction'), 'error': 'state of shape %s, expected (%i,)' % (state.shape, self._Model.input_dim)}
+
+        arrival = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((state, future))
+        try:
+            q_values = await future
+        except Exception as error:  # the forward pass of the batch failed
+            self._errors += 1
+            return {'junction': message.get('junction'), 'error': 'prediction failed: %s' % error}
+        latency = (time.perf_counter() - arrival) * 1000
+        self._latencies.append(latency)
+        self._over_budget += latency > self._budget
+        return {'junction': message.get('junction'), 'action': int(np.argmax(q_values)), 'q_values': q_values.tolist(), 'latency_ms': latency}
+
+
+    async def _batcher(self):
+        """
+        Micro-batching: take the waiting requests (up to max_batch), waiting at most max_wait after the first one for
+        more unless every connected junction already has its request in, and answer all of them with a single predict_batch call
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0 or len(batch) >= self._connections:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                q_values = self._Model.predict_batch(np.stack([state for state, _ in batch]))
+            except Exception as error:  # answered with an error, the batcher keeps serving the next requests
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self._batch_sizes.append(len(batch))
+            for (_, future), q in zip(batch, q_values):
+                if not future.done():
+                    future.set_result(q)
+
+
+    def stats(self):
+        stats = latency_stats(list(self._latencies))
+        stats.update(over_budget=self._over_budget, errors=self._errors, budget_ms=self._budget, mean_batch=float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0)
+        return stats
+
+
+class RemoteModel:
+    def __init__(self, input_dim, host='127.0.0.1', port=8765, junction='J1'):
+        self._input_dim = input_dim
+        self._junction = junction
+        self._socket = socket.create_connection((host, port))
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile('rb')
+
+
+    def predict_one(self, state):
+        """
+        Ask the controller service: stands in for the field controller of the junction in the SUMO client
+        """
+        message = {'junction': self._junction, 'state': np.asarray(state).astype(int).tolist()}
+        self._socket.sendall((json.dumps(message) + "\n").encode())
+        reply = json.loads(self._file.readline())
+        if 'error' in reply:
+            raise ValueError("Controller service: " + reply['error'])
+        return np.array([reply['q_values']])
+
+
+    @property
+    def input_dim(self):
+        return self._input_dim
+
+
+    @property
+    def q_cache(self):
+        return None
+
+
+async def replay_junction(host, port, junction, states, interval):
+    """
+    Send the recorded states one after the other as a junction would, and return the round-trip latencies in ms
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies = []
+    for state in states:
+        start = time.perf_counter()
+        writer.write((json.dumps({'junction': junction, 'state': state.astype(int).tolist()}) + "\n").encode())
+        await writer.drain()
+        await reader.readline()
+        latencies.append((time.perf_counter() - start) * 1000)
+        if interval:
+            await asyncio.sleep(interval)
+    writer.close()
+    return latencies
+
+
+async def replay_client(host, port, states, junctions, requests, interval):
+    """
+    Replay client: several junctions send recorded states at the same time, then the service stats are read
+    """
+    rng = np.random.default_rng(0)
+    tasks = [replay_junction(host, port, 'J%i' % (i + 1), states[rng.integers(len(states), size=requests)], interval) for i in range(junctions)]
+    latencies = [latency for junction_latencies in await asyncio.gather(*tasks) for latency in junction_latencies]
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"type": "stats"}\n')
+    await writer.drain()
+    service_stats = json.loads(await reader.readline())
+    writer.close()
+    return latency_stats(latencies), service_stats
+
+
+def load_model(config):
+    model_path = os.path.join(config['models_path_name'], 'model_%i' % config['model_to_test'], '')
+    if config['backend'] == 'distilled':
+        return DistilledModel(input_dim=config['num_states'], model_path=model_path)
+    return TestModel(input_dim=config['num_states'], model_path=model_path, sparse_input=config['sparse_input'])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Real-time controller service for the model, and its replay and SUMO clients")
+    parser.add_argument('mode', choices=['serve', 'replay', 'sumo'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=32, help="serve: most requests answered by one forward pass")
+    parser.add_argument('--max-wait', type=float, default=1.0, help="serve: ms the first request of a batch waits for others")
+    parser.add_argument('--budget', type=float, default=10.0, help="serve: latency budget in ms, the requests over it are counted")
+    parser.add_argument('--corpus', default=os.path.join('offline_evaluation', 'state_corpus.npz'), help="replay: recorded states, see offline_evaluation.py")
+    parser.add_argument('--junctions', type=int, default=8, help="replay: junctions sending requests at the same time")
+    parser.add_argument('--requests', type=int, default=1000, help="replay: requests of every junction")
+    parser.add_argument('--interval', type=float, default=0.0, help="replay: ms between two requests of a junction")
+    args = parser.parse_args()
+
+    config = import_test_configuration(config_file='testing_settings.ini')
+
+    if args.mode == 'serve':
+        Service = ControllerService(load_model(config), args.max_batch, args.max_wait, args.budget)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # stopped as a daemon: print the stats too
+        try:
+            asyncio.run(Service.serve(args.host, args.port))
+        except (KeyboardInterrupt, SystemExit):
+            print('\nService stats:', ", ".join("%s %.3f" % item for item in Service.stats().items()))
+
+    elif args.mode == 'replay':
+        if not os.path.isfile(args.corpus):
+            sys.exit("No recorded states, run offline_evaluation.py --record first")
+        with np.load(args.corpus) as corpus:
+            states = corpus['states']
+        client_stats, service_stats = asyncio.run(replay_client(args.host, args.port, states, args.junctions, args.requests, args.interval / 1000))
+        print('Round trip:', ", ".join("%s %.3f" % item for item in client_stats.items()))
+        print('Service:   ', ", ".join("%s %.3f" % item for item in service_stats.items()))
+
+    else:
+        from testing_simulation import Simulation
+        from generator import TrafficGenerator
+        from sumo_session import SumoSession
+        from utils import set_sumo
+
+        sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], config['route_file_name'])
+        TrafficGen = TrafficGenerator(config['max_steps'], config['n_cars_generated'], route_file=os.path.join('intersection', config['route_file_name']))
+        Sim = Simulation(RemoteModel(config['num_states'], args.host, args.port), TrafficGen, SumoSession(sumo_cmd, persistent=False), config['max_steps'],
+                         config['green_duration'], config['yellow_duration'], config['num_states'], config['num_actions'])
+        simulation_time = Sim.run(config['episode_seed'])
+        decision_ms = np.array(Sim.decision_times) * 1000
+        print('Simulation time: %s s - Mean queue: %.2f' % (simulation_time, np.mean(Sim.queue_length_episode)))
+        print('Decision (state + service round trip):', ", ".join("%s %.3f" % item for item in latency_stats(list(decision_ms)).items()))
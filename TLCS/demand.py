@@ -0,0 +1,118 @@
+import numpy as np
+
+ORIGINS = ["DR2", "RU1", "UL2", "LD1"]
+DESTINATIONS = ["UR2", "LU1", "DL2", "RD1"]  # destination straight ahead of each origin, in the same order
+
+# the 12 routes of the Baneswor network, as (incoming road, outgoing road)
+ROUTES = [("DR2", "LU1"), ("DR2", "UR2"), ("DR2", "RD1"),
+          ("RU1", "DL2"), ("RU1", "LU1"), ("RU1", "UR2"),
+          ("UL2", "RD1"), ("UL2", "DL2"), ("UL2", "LU1"),
+          ("LD1", "UR2"), ("LD1", "RD1"), ("LD1", "DL2")]
+
+
+def default_od_matrix():
+    """
+    Origin-destination weights equivalent to TrafficGenerator: every arm equally likely, 75% straight, 25% turning
+    (split equally between the two turns), as a 4 x 4 matrix with rows = ORIGINS and columns = DESTINATIONS
+    """
+    od = np.full((4, 4), 0.25 / 8)
+    np.fill_diagonal(od, 0.75 / 4)
+    od[[0, 1, 2, 3], [2, 3, 0, 1]] = 0  # the outgoing road of the arm a car comes from (DR2 -> DL2, ...) is not a route
+    return od
+
+
+def peak_profile(n_slots, base_rate, peaks):
+    """
+    Build a rate profile (vehicles per hour for every slot) from a base rate and (center_slot, width_slots, extra_rate)
+    gaussian peaks, e.g. a morning and an evening peak over 24 hourly slots
+    """
+    slots = np.arange(n_slots)
+    rates = np.full(n_slots, float(base_rate))
+    for center, width, extra in peaks:
+        rates += extra * np.exp(-0.5 * ((slots - center) / width) ** 2)
+    return rates
+
+
+class DemandGenerator:
+    def __init__(self, max_steps, rates, od_matrices=None, slot_seconds=3600, chunk_seconds=600, route_file='intersection/episode_routes.rou.xml'):
+        self._max_steps = max_steps
+        self._rates = np.asarray(rates, dtype=float)  # vehicles per hour in every slot of slot_seconds
+        self._slot_seconds = slot_seconds
+        self._chunk_seconds = chunk_seconds
+        self._route_file = route_file
+        self._route_cdf = self._build_route_cdf(od_matrices)
+        self._departure_steps = np.array([], dtype=int)
+
+
+    def _build_route_cdf(self, od_matrices):
+        """
+        Cumulative probability of the 12 routes for every slot, from one OD matrix or one per slot
+        """
+        if od_matrices is None:
+            od_matrices = default_od_matrix()
+        od_matrices = np.asarray(od_matrices, dtype=float)
+        if od_matrices.ndim == 2:
+            od_matrices = np.repeat(od_matrices[None], len(self._rates), axis=0)
+
+        origin_index = np.array([ORIGINS.index(origin) for origin, _ in ROUTES])
+        destination_index = np.array([DESTINATIONS.index(destination) for _, destination in ROUTES])
+        weights = od_matrices[:, origin_index, destination_index]  # slots x routes, the pairs that are not a route are dropped
+        return np.cumsum(weights / weights.sum(axis=1, keepdims=True), axis=1)
+
+
+    def generate_routefile(self, seed):
+        """
+        Generate the cars of one episode as a non-homogeneous Poisson process following the rate profile, one chunk of
+        chunk_seconds at a time: every chunk is drawn with array operations and written to the route file right away,
+        so the memory used does not depend on the number of cars
+        """
+        rng = np.random.default_rng(seed)
+        car_counter = 0
+        departure_steps = []
+
+        with open(self._route_file, "w") as routes:
+            print("""<routes>
+    <vType accel="1.0" decel="4.5" id="standard_car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5" />
+""", file=routes)
+            for origin, destination in ROUTES:
+                print('    <route id="%s_%s" edges="%s %s"/>' % (origin, destination, origin, destination), file=routes)
+
+            for chunk_start in range(0, self._max_steps, self._chunk_seconds):
+                seconds = np.arange(chunk_start, min(chunk_start + self._chunk_seconds, self._max_steps))
+                slots = np.minimum(seconds // self._slot_seconds, len(self._rates) - 1)
+                counts = rng.poisson(self._rates[slots] / 3600)  # cars generated in every second of the chunk
+                n_cars = counts.sum()
+                if n_cars == 0:
+                    continue
+
+                departs = np.sort(np.repeat(seconds, counts) + rng.random(n_cars))  # SUMO expects the departures in order
+                car_slots = np.repeat(slots, counts)
+                route_index = (rng.random(n_cars)[:, None] > self._route_cdf[car_slots]).sum(axis=1)
+                route_index = np.minimum(route_index, len(ROUTES) - 1)  # guard against rounding of the last cdf value
+
+                route_ids = np.array(["%s_%s" % route for route in ROUTES])[route_index]
+                ids = np.char.add(np.char.add(route_ids, "_"), np.arange(car_counter, car_counter + n_cars).astype(str))
+                lines = ['    <vehicle id="%s" type="standard_car" route="%s" depart="%.2f" departLane="random" departSpeed="10" />\n' % row
+                         for row in zip(ids, route_ids, departs)]
+                routes.write("".join(lines))
+
+                car_counter += n_cars
+                departure_steps.append(np.unique(np.floor(departs).astype(int)))
+
+            print("</routes>", file=routes)
+
+        self._departure_steps = np.concatenate(departure_steps) if departure_steps else np.array([], dtype=int)  # at most max_steps values
+        return car_counter
+
+
+    def next_departure(self, step):
+        """
+        Return the first step after the given one when a car is generated, None if no car is generated any more
+        """
+        i = np.searchsorted(self._departure_steps, step, side='right')
+        return self._departure_steps[i] if i < len(self._departure_steps) else None
+
+
+    @property
+    def route_file(self):
+        return self._route_file
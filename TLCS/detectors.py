@@ -0,0 +1,171 @@
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+import traci
+import traci.constants as tc
+
+DETECTORS_FILE = os.path.join('intersection', 'state_detectors.add.xml')
+TRIGGER_DETECTORS_FILE = os.path.join('intersection', 'trigger_detectors.add.xml')
+
+# lane groups of the state, as in Simulation._get_state: state index = 10 * lane group + cell
+LANE_GROUPS = {
+    "DR2_0": 0, "DR2_1": 0, "DR2_2": 1,
+    "RU1_0": 2, "RU1_1": 2, "RU1_2": 2, "RU1_3": 3, "RU1_4": 3,
+    "UL2_0": 4, "UL2_1": 4, "UL2_2": 5,
+    "LD1_0": 6, "LD1_1": 6, "LD1_2": 6, "LD1_3": 7, "LD1_4": 7,
+}
+CELL_LIMITS = [7, 14, 21, 28, 40, 60, 100, 160, 400, 750]  # upper limit of every cell, in meters of 200 - lane position
+STATE_ORIGIN = 200
+VEHICLE_LENGTH = 5.0  # length of standard_car
+BOUNDARY_MARGIN = 0.0001  # detectors see a car that only touches their boundary
+STOP_LINE_LENGTH = 20.0  # meters before the light watched by the stop line detectors of the event trigger
+
+
+def net_file_of(sumocfg_file):
+    """
+    Return the path of the network file used by a .sumocfg file
+    """
+    net_file = ET.parse(sumocfg_file).getroot().find('input/net-file').get('value')
+    return os.path.join(os.path.dirname(sumocfg_file), net_file)
+
+
+def incoming_lane_lengths(net_file):
+    """
+    Read the length of every lane of the state from the network file
+    """
+    lengths = {}
+    for lane in ET.parse(net_file).getroot().iter('lane'):
+        if lane.get('id') in LANE_GROUPS:
+            lengths[lane.get('id')] = float(lane.get('length'))
+    return lengths
+
+
+def detector_layout(lane_lengths):
+    """
+    Place one lane area detector per lane and cell, as (detector id, lane, start, end, state index, at lane end).
+    The per-vehicle encoder uses the front of the car while a detector sees any part of it, so every detector ends one car
+    length before the end of its cell: it is occupied exactly when the front of a car is in the cell. Cell boundaries are
+    exclusive at the start, like in the per-vehicle encoder (a car stopped at the boundary belongs to the cell farther from
+    the light). The detector of the last cell of a lane cannot be shortened, the cell is shorter than a car: it also sees
+    the tail of the cars crossing the junction, which are told apart by DetectorStateEncoder.get_state
+    """
+    layout = []
+    for lane, length in lane_lengths.items():
+        lower = 0
+        for cell, limit in enumerate(CELL_LIMITS):
+            start, end = max(STATE_ORIGIN - limit, 0), min(STATE_ORIGIN - lower, length)  # front positions of the cell on this lane
+            lower = limit
+            if end <= start:
+                continue  # cell beyond the end of the lane: never occupied
+            lane_end = end == length
+            if not lane_end:
+                end -= VEHICLE_LENGTH
+            layout.append(('e2_%s_%i' % (lane, cell), lane, start + BOUNDARY_MARGIN, end + BOUNDARY_MARGIN * (not lane_end),
+                           10 * LANE_GROUPS[lane] + cell, lane_end))
+    return layout
+
+
+def stop_line_layout(lane_lengths, length=STOP_LINE_LENGTH):
+    """
+    Place one lane area detector on the last meters of every incoming lane, in the format of detector_layout
+    """
+    return [('stop_%s' % lane, lane, max(lane_length - length, 0), lane_length, LANE_GROUPS[lane], True) for lane, lane_length in lane_lengths.items()]
+
+
+def write_detectors_additional(additional_file, layout):
+    """
+    Write the detectors as SUMO additional file, without file output: they are only read through TraCI
+    """
+    temporary_file = '%s.%i.tmp' % (additional_file, os.getpid())
+    with open(temporary_file, "w") as file:
+        print('<additional>', file=file)
+        for detector_id, lane, start, end, _, _ in layout:
+            print('    <laneAreaDetector id="%s" lane="%s" pos="%.4f" endPos="%.4f" period="86400" file="%s"/>' % (detector_id, lane, start, end, os.devnull), file=file)
+        print('</additional>', file=file)
+    os.replace(temporary_file, additional_file)  # atomic: runs started at the same time never read a partial file
+
+
+class DetectorStateEncoder:
+    def __init__(self, num_states, sumocfg_file, additional_file=DETECTORS_FILE):
+        self._num_states = num_states
+        layout = detector_layout(incoming_lane_lengths(net_file_of(sumocfg_file)))
+        self._cell_detectors = [detector[0] for detector in layout if not detector[5]]
+        self._cell_indices = np.array([detector[4] for detector in layout if not detector[5]])
+        self._lane_end_detectors = [(detector[0], detector[1], detector[4]) for detector in layout if detector[5]]
+        write_detectors_additional(additional_file, layout)
+
+
+    def subscribe(self):
+        """
+        Subscribe to the detectors, to be done after every start or load of the simulation: the values then come with the
+        answer of every simulationStep, without further TraCI calls. The detectors at the end of the lanes give the ids
+        of their cars (at most two: one stopped at the light, one crossing), the other ones just the number of cars
+        """
+        for detector_id in self._cell_detectors:
+            traci.lanearea.subscribe(detector_id, (tc.LAST_STEP_VEHICLE_NUMBER,))
+        for detector_id, _, _ in self._lane_end_detectors:
+            traci.lanearea.subscribe(detector_id, (tc.LAST_STEP_VEHICLE_ID_LIST,))
+
+
+    def get_state(self):
+        """
+        Return the cell occupancy state from the detectors: the cost depends on the number of lanes and detectors, not
+        on the number of cars. A car seen at the end of a lane only counts if its front is still on the lane
+        """
+        results = traci.lanearea.getAllSubscriptionResults()
+        counts = np.array([results[detector_id][tc.LAST_STEP_VEHICLE_NUMBER] for detector_id in self._cell_detectors])
+        state = np.zeros(self._num_states)
+        state[self._cell_indices[counts > 0]] = 1
+        for detector_id, lane, index in self._lane_end_detectors:
+            if any(traci.vehicle.getLaneID(car_id) == lane for car_id in results[detector_id][tc.LAST_STEP_VEHICLE_ID_LIST]):
+                state[index] = 1
+        return state
+
+
+    @property
+    def n_detectors(self):
+        return len(self._cell_detectors) + len(self._lane_end_detectors)
+
+
+class StopLineDetectors:
+    def __init__(self, sumocfg_file, junction='J1', additional_file=TRIGGER_DETECTORS_FILE):
+        layout = stop_line_layout(incoming_lane_lengths(net_file_of(sumocfg_file)))
+        self._detectors = {detector[1]: detector[0] for detector in layout}  # lane: detector id
+        self._junction = junction
+        self._controlled_lanes = []
+        self._watched = []  # detectors of the red lanes that were empty at the decision
+        write_detectors_additional(additional_file, layout)
+
+
+    def subscribe(self):
+        """
+        Subscribe to the detectors, to be done after every start or load of the simulation, as DetectorStateEncoder.subscribe
+        """
+        for detector_id in self._detectors.values():
+            traci.lanearea.subscribe(detector_id, (tc.LAST_STEP_VEHICLE_NUMBER,))
+        self._controlled_lanes = traci.trafficlight.getControlledLanes(self._junction)  # lane of every signal of the junction
+
+
+    def start_green(self):
+        """
+        At a decision, once the green is set: watch the stop line of the incoming lanes without any green signal that have
+        no car there yet. One TraCI call per decision
+        """
+        signals = traci.trafficlight.getRedYellowGreenState(self._junction)
+        green_lanes = {lane for lane, signal in zip(self._controlled_lanes, signals) if signal in 'gG'}
+        results = traci.lanearea.getAllSubscriptionResults()
+        self._watched = [detector_id for lane, detector_id in self._detectors.items()
+                         if lane not in green_lanes and results[detector_id][tc.LAST_STEP_VEHICLE_NUMBER] == 0]
+
+
+    def activated(self):
+        """
+        True when a car reached the stop line of a watched red lane: read from the subscription results, no TraCI call
+        """
+        results = traci.lanearea.getAllSubscriptionResults()
+        return any(results[detector_id][tc.LAST_STEP_VEHICLE_NUMBER] > 0 for detector_id in self._watched)
+
+
+    @property
+    def n_detectors(self):
+        return len(self._detectors)
@@ -0,0 +1,165 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import json
+import argparse
+import timeit
+import numpy as np
+
+from testing_simulation import Simulation
+from generator import TrafficGenerator
+from sumo_session import SumoSession
+from model import TestModel, DistilledModel
+from offline_evaluation import CORPUS_FILE, record_corpus
+from utils import import_test_configuration, set_sumo
+
+
+def fit_tree(states, actions, weights, num_actions, max_depth, min_leaf_weight):
+    """
+    Fit a classification tree on binary states with weighted gini impurity: every split tests one cell (occupied goes
+    right). The impurity of every candidate cell comes from a single product states x class weights per node.
+    Return the tree as flat lists (feature, left, right, action), feature -1 for the leaves
+    """
+    feature, left, right, action = [], [], [], []
+    one_hot = np.eye(num_actions)[actions] * weights[:, None]
+
+    def impurity(class_weights):
+        total = class_weights.sum(axis=-1)
+        return total - (class_weights ** 2).sum(axis=-1) / np.maximum(total, 1e-12)  # weighted gini: total * (1 - sum p^2)
+
+    def grow(indices, depth):
+        node = len(feature)
+        class_weights = one_hot[indices].sum(axis=0)
+        feature.append(-1)
+        left.append(-1)
+        right.append(-1)
+        action.append(int(np.argmax(class_weights)))
+        if depth == max_depth or class_weights.max() == class_weights.sum():
+            return node
+
+        occupied = states[indices].T @ one_hot[indices]  # cells x classes: class weights of the states with the cell occupied
+        empty = class_weights - occupied
+        split_impurity = impurity(occupied) + impurity(empty)
+        valid = (occupied.sum(axis=1) >= min_leaf_weight) & (empty.sum(axis=1) >= min_leaf_weight)
+        split_impurity[~valid] = np.inf
+        best = int(np.argmin(split_impurity))
+        if not np.isfinite(split_impurity[best]) or split_impurity[best] >= impurity(class_weights) - 1e-9:
+            return node
+
+        goes_right = states[indices, best] > 0
+        feature[node] = best
+        left[node] = grow(indices[~goes_right], depth + 1)
+        right[node] = grow(indices[goes_right], depth + 1)
+        return node
+
+    grow(np.arange(len(states)), 0)
+    return {'feature': feature, 'left': left, 'right': right, 'action': action}
+
+
+def tree_predict(tree, states):
+    """
+    Actions of the tree for a batch of states, all states going down one level at a time
+    """
+    feature, left, right, action = (np.array(tree[key]) for key in ('feature', 'left', 'right', 'action'))
+    nodes = np.zeros(len(states), dtype=int)
+    inner = feature[nodes] >= 0
+    while inner.any():
+        rows = np.flatnonzero(inner)
+        occupied = states[rows, feature[nodes[rows]]] > 0
+        nodes[rows] = np.where(occupied, right[nodes[rows]], left[nodes[rows]])
+        inner = feature[nodes] >= 0
+    return action[nodes]
+
+
+def lookup_table(states, actions):
+    """
+    Table of the teacher decisions keyed by the packed states, as hex strings for the json file
+    """
+    keys = np.packbits(states != 0, axis=1)
+    return {key.tobytes().hex(): int(action) for key, action in zip(keys, actions)}
+
+
+def agreement(predicted, actions, weights):
+    return np.sum(weights * (predicted == actions)) / np.sum(weights)
+
+
+def latency_us(Model, states, repeats=3):
+    """
+    Mean time of predict_one in microseconds, best of a few passes over the states
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start_time = timeit.default_timer()
+        for state in states:
+            np.argmax(Model.predict_one(state))
+        best = min(best, timeit.default_timer() - start_time)
+    return 1e6 * best / len(states)
+
+
+def closed_loop_queue(config, Model, seed):
+    """
+    Mean queue length of one test episode controlled by the model
+    """
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'], config['route_file_name'])
+    TrafficGen = TrafficGenerator(config['max_steps'], config['n_cars_generated'], route_file=os.path.join('intersection', config['route_file_name']))
+    Sim = Simulation(Model, TrafficGen, SumoSession(sumo_cmd, persistent=False), config['max_steps'], config['green_duration'],
+                     config['yellow_duration'], config['num_states'], config['num_actions'])
+    Sim.run(seed)
+    return np.mean(Sim.queue_length_episode)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Distill a trained model into a decision tree and a lookup table, without tensorflow at inference")
+    parser.add_argument('--model', type=int, default=None, help="teacher model (default: model_to_test)")
+    parser.add_argument('--corpus', default=CORPUS_FILE, help="recorded states, see offline_evaluation.py (recorded with the teacher if missing)")
+    parser.add_argument('--episodes', type=int, default=3, help="episodes recorded when the corpus is missing")
+    parser.add_argument('--every', type=int, default=5, help="steps between two recorded states when the corpus is missing")
+    parser.add_argument('--max-depth', type=int, default=12)
+    parser.add_argument('--min-leaf', type=float, default=2, help="minimum occurrences of the recorded states in every leaf")
+    parser.add_argument('--holdout', type=float, default=0.2, help="share of the distinct states kept out of the fit to measure the generalization")
+    parser.add_argument('--no-table', action='store_true', help="export the tree alone")
+    parser.add_argument('--closed-loop', action='store_true', help="also compare the queue length of one test episode run by the teacher and by the student")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = import_test_configuration(config_file='testing_settings.ini')
+    model_n = args.model if args.model is not None else config['model_to_test']
+    model_path = os.path.join(config['models_path_name'], 'model_%i' % model_n, '')
+    Teacher = TestModel(input_dim=config['num_states'], model_path=model_path)
+
+    if not os.path.isfile(args.corpus):
+        record_corpus(config, Teacher, args.episodes, args.every, args.corpus)
+    with np.load(args.corpus) as corpus:
+        states, counts = corpus['states'].astype(np.float32), corpus['counts'].astype(float)
+    actions = np.argmax(Teacher.predict_batch(states), axis=1)
+
+    rng = np.random.default_rng(args.seed)
+    holdout = rng.random(len(states)) < args.holdout
+    tree = fit_tree(states[~holdout], actions[~holdout], counts[~holdout], config['num_actions'], args.max_depth, args.min_leaf)
+    table = {} if args.no_table else lookup_table(states, actions)  # the final table keeps every recorded state
+
+    policy_file = os.path.join(model_path, 'distilled_policy.json')
+    with open(policy_file, "w") as file:
+        json.dump({'num_actions': config['num_actions'], 'tree': tree, 'table': table}, file)
+    Student = DistilledModel(input_dim=config['num_states'], model_path=model_path)
+
+    tree_actions = tree_predict(tree, states)
+    lines = ['Distillation of model_%i on %i recorded states (%i distinct)' % (model_n, counts.sum(), len(states))]
+    lines.append('Tree: %i nodes, depth <= %i' % (len(tree['feature']), args.max_depth))
+    lines.append('Tree agreement with the teacher: %.1f%% on the fitted states, %.1f%% on the held-out states' % (
+        100 * agreement(tree_actions[~holdout], actions[~holdout], counts[~holdout]),
+        100 * agreement(tree_actions[holdout], actions[holdout], counts[holdout]) if holdout.any() else np.nan))
+    lines.append('Table: %i states, %.1f KB exported' % (len(table), os.path.getsize(policy_file) / 1000))
+    latency_states = states[rng.permutation(len(states))[:1000]]
+    lines.append('Decision latency: teacher %.1f us, student %.1f us' % (latency_us(Teacher, latency_states), latency_us(Student, latency_states)))
+    if args.closed_loop:
+        seed = config['episode_seed']
+        lines.append('Mean queue length (seed %i): teacher %.2f, student %.2f' % (seed, closed_loop_queue(config, Teacher, seed), closed_loop_queue(config, Student, seed)))
+    report = "\n".join(lines)
+    print('\n' + report)
+
+    with open(os.path.join(model_path, 'distillation_report.txt'), "w") as file:
+        file.write(report + "\n")
+    print("----- Distilled policy saved at:", policy_file)
@@ -0,0 +1,279 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import io
+import os
+import sys
+import time
+import random
+import socket
+import struct
+import argparse
+import threading
+import subprocess
+import socketserver
+import numpy as np
+
+from model import forward
+from utils import import_train_configuration
+
+# messages: 1 byte type + 4 bytes length + payload, over TCP
+TRANSITIONS = 1  # worker -> learner: compressed batch of transitions
+PULL = 2  # worker -> learner: ask for the last weights
+WEIGHTS = 3  # learner -> worker: version and compressed weights
+HEADER = struct.Struct('!BI')
+
+
+def send_message(sock, kind, payload=b''):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+def recv_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock):
+    kind, length = HEADER.unpack(recv_exact(sock, HEADER.size))
+    return kind, recv_exact(sock, length)
+
+
+def encode_transitions(transitions):
+    """
+    Compress a list of (state, action, reward, next_state): the binary states are packed into bits (10 bytes for 80
+    cells), then the arrays are zipped
+    """
+    states, actions, rewards, next_states = zip(*transitions)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, states=np.packbits(np.array(states) != 0, axis=1), actions=np.array(actions, dtype=np.uint8),
+                        rewards=np.array(rewards, dtype=np.float32), next_states=np.packbits(np.array(next_states) != 0, axis=1))
+    return buffer.getvalue()
+
+
+def decode_transitions(payload, num_states):
+    with np.load(io.BytesIO(payload)) as arrays:
+        states = np.unpackbits(arrays['states'], axis=1, count=num_states).astype(float)
+        next_states = np.unpackbits(arrays['next_states'], axis=1, count=num_states).astype(float)
+        return list(zip(states, arrays['actions'].astype(int), arrays['rewards'].astype(float), next_states))
+
+
+def encode_weights(version, weights):
+    buffer = io.BytesIO()
+    arrays = {'version': np.array(version)}
+    for i, (kernel, bias) in enumerate(weights):
+        arrays['kernel_%i' % i] = kernel
+        arrays['bias_%i' % i] = bias
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_weights(payload):
+    with np.load(io.BytesIO(payload)) as arrays:
+        n_layers = (len(arrays.files) - 1) // 2
+        return int(arrays['version']), [(arrays['kernel_%i' % i], arrays['bias_%i' % i]) for i in range(n_layers)]
+
+
+class Learner:
+    def __init__(self, Model, Memory, gamma, num_states, publish_every=10):
+        self._Model = Model
+        self._Memory = Memory
+        self._gamma = gamma
+        self._num_states = num_states
+        self._publish_every = publish_every  # training batches between two weight versions
+        self._lock = threading.Lock()  # the memory is filled by the connection threads and sampled by the training loop
+        self._version = 0
+        self._weights_payload = encode_weights(0, Model.weights)
+        self._transitions = 0
+        self._bytes = 0
+        self._batches = 0
+
+
+    def serve(self, host, port):
+        """
+        Accept the workers in a background thread, one thread per worker connection
+        """
+        learner = self
+
+        class WorkerHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    while True:
+                        kind, payload = recv_message(self.request)
+                        if kind == TRANSITIONS:
+                            learner.add_transitions(payload)
+                        elif kind == PULL:
+                            send_message(self.request, WEIGHTS, learner.weights_payload)
+                except ConnectionError:
+                    pass
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), WorkerHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+
+    def add_transitions(self, payload):
+        transitions = decode_transitions(payload, self._num_states)
+        with self._lock:
+            for transition in transitions:
+                self._Memory.add_sample(transition)
+            self._transitions += len(transitions)
+            self._bytes += len(payload)
+
+
+    def train(self, duration):
+        """
+        Train on the replay memory for the given seconds, batch after batch, publishing new weights every publish_every batches
+        """
+        end_time = time.time() + duration
+        while time.time() < end_time:
+            with self._lock:
+                batch = self._Memory.get_samples(self._Model.batch_size)
+            if not batch:
+                time.sleep(0.05)  # the memory is not full enough yet
+                continue
+            states = np.array([sample[0] for sample in batch])
+            actions = np.array([sample[1] for sample in batch])
+            rewards = np.array([sample[2] for sample in batch])
+            q_s_a = self._Model.predict_batch(states)
+            q_s_a_d = self._Model.predict_batch(np.array([sample[3] for sample in batch]))
+            q_s_a[np.arange(len(batch)), actions] = rewards + self._gamma * np.amax(q_s_a_d, axis=1)  # same targets as Simulation._replay
+            self._Model.train_batch(states, q_s_a)
+            self._batches += 1
+            if self._batches % self._publish_every == 0:
+                self._version += 1
+                self._weights_payload = encode_weights(self._version, self._Model.weights)
+
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    @property
+    def weights_payload(self):
+        return self._weights_payload
+
+
+    @property
+    def transitions(self):
+        return self._transitions
+
+
+    @property
+    def bytes_received(self):
+        return self._bytes
+
+
+    @property
+    def batches(self):
+        return self._batches
+
+
+    @property
+    def version(self):
+        return self._version
+
+
+def run_worker(config, host, port, index, epsilon, ship_every, pull_interval, seed):
+    """
+    Rollout worker: run episodes with the last weights pulled from the learner (numpy forward pass, epsilon-greedy) and
+    ship the transitions every ship_every decisions, until the learner goes away
+    """
+    from environment import make_env
+
+    env = make_env(config, index)
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        send_message(sock, PULL)
+        version, weights = decode_weights(recv_message(sock)[1])
+        last_pull = time.time()
+        state, _ = env.reset(seed)
+        transitions = []
+        while True:
+            if random.random() < epsilon:
+                action = random.randint(0, config['num_actions'] - 1)
+            else:
+                action = int(np.argmax(forward(weights, state[None])))
+            next_state, reward, done, _ = env.step(action)
+            transitions.append((state, action, reward, next_state))
+            if done:
+                seed += 1000  # next episode of this worker, away from the seeds of the other workers
+                state, _ = env.reset(seed)
+            else:
+                state = next_state
+
+            if len(transitions) >= ship_every:
+                send_message(sock, TRANSITIONS, encode_transitions(transitions))
+                transitions = []
+            if time.time() - last_pull >= pull_interval:
+                send_message(sock, PULL)
+                version, weights = decode_weights(recv_message(sock)[1])
+                last_pull = time.time()
+    except (ConnectionError, OSError):
+        pass  # the learner is done
+    finally:
+        env.close()
+        sock.close()
+
+
+def build_learner(config, publish_every):
+    from memory import Memory
+    from model import TrainModel
+
+    Model = TrainModel(config['num_layers'], config['width_layers'], config['batch_size'], config['learning_rate'],
+                       input_dim=config['num_states'], output_dim=config['num_actions'])
+    return Learner(Model, Memory(config['memory_size_max'], config['memory_size_min']), config['gamma'], config['num_states'], publish_every)
+
+
+def worker_command(args, index):
+    return [sys.executable, os.path.abspath(__file__), 'worker', '--host', args.host, '--port', str(args.port), '--index', str(index),
+            '--epsilon', str(args.epsilon), '--ship-every', str(args.ship_every), '--pull-interval', str(args.pull_interval)]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Distributed rollouts: a learner owning the model and the memory, rollout workers on any host")
+    parser.add_argument('mode', choices=['learner', 'worker', 'local'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--duration', type=float, default=60, help="learner/local: seconds of training (of every run in local mode)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="local: number of local workers of every run")
+    parser.add_argument('--index', type=int, default=0, help="worker: index, for the route file and the seeds")
+    parser.add_argument('--epsilon', type=float, default=0.1, help="worker: exploration rate")
+    parser.add_argument('--ship-every', type=int, default=16, help="worker: decisions between two transition batches")
+    parser.add_argument('--pull-interval', type=float, default=5.0, help="worker: seconds between two weight pulls")
+    parser.add_argument('--publish-every', type=int, default=10, help="learner: training batches between two weight versions")
+    args = parser.parse_args()
+
+    config = import_train_configuration(config_file='training_settings.ini')
+
+    if args.mode == 'worker':
+        run_worker(config, args.host, args.port, args.index, args.epsilon, args.ship_every, args.pull_interval, seed=args.index)
+        sys.exit(0)
+
+    runs = [None] if args.mode == 'learner' else args.workers
+    results = []
+    for n_workers in runs:
+        ParameterServer = build_learner(config, args.publish_every)
+        ParameterServer.serve(args.host, args.port)
+        print('\n----- Learner on %s:%i' % (args.host, args.port) + ('' if n_workers is None else ', %i local workers' % n_workers))
+        workers = [subprocess.Popen(worker_command(args, i), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for i in range(n_workers or 0)]
+        start_time = time.time()
+        ParameterServer.train(args.duration)
+        elapsed = time.time() - start_time
+        ParameterServer.close()
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+        results.append((n_workers or 0, ParameterServer.transitions, ParameterServer.transitions / elapsed, ParameterServer.bytes_received / max(ParameterServer.transitions, 1), ParameterServer.batches, ParameterServer.version))
+
+    print("\n%8s %12s %15s %12s %10s %10s" % ('workers', 'transitions', 'transitions/s', 'bytes/trans', 'batches', 'versions'))
+    for n_workers, transitions, rate, size, batches, version in results:
+        print("%8i %12i %15.1f %12.1f %10i %10i" % (n_workers, transitions, rate, size, batches, version))
@@ -0,0 +1,46 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+# keras layer kept in its own module, like sparse_layer.py: model.py imports it only when a dueling network is built or loaded
+
+
+class DuelingHead(keras.layers.Layer):
+    """
+    Output layer with a state value stream and an action advantage stream: Q = V + A - mean(A).
+    It is linear in its input, so dense_equivalent folds it into the kernel and bias of a plain dense layer with the
+    same outputs, which is what the numpy forward pass of TestModel runs
+    """
+    def __init__(self, units, **kwargs):
+        super().__init__(**kwargs)
+        self.units = units
+
+
+    def build(self, input_shape):
+        n_inputs = int(input_shape[-1])
+        self.value_kernel = self.add_weight(name='value_kernel', shape=(n_inputs, 1), initializer='glorot_uniform')
+        self.value_bias = self.add_weight(name='value_bias', shape=(1,), initializer='zeros')
+        self.advantage_kernel = self.add_weight(name='advantage_kernel', shape=(n_inputs, self.units), initializer='glorot_uniform')
+        self.advantage_bias = self.add_weight(name='advantage_bias', shape=(self.units,), initializer='zeros')
+
+
+    def call(self, inputs):
+        value = tf.matmul(inputs, self.value_kernel) + self.value_bias
+        advantage = tf.matmul(inputs, self.advantage_kernel) + self.advantage_bias
+        return value + advantage - tf.reduce_mean(advantage, axis=1, keepdims=True)
+
+
+    def dense_equivalent(self):
+        """
+        Kernel and bias of the dense layer computing the same action values
+        """
+        value_kernel, value_bias, advantage_kernel, advantage_bias = self.get_weights()
+        kernel = value_kernel + advantage_kernel - advantage_kernel.mean(axis=1, keepdims=True)
+        bias = value_bias + advantage_bias - advantage_bias.mean()
+        return kernel.astype(np.float32), bias.astype(np.float32)
+
+
+    def get_config(self):
+        config = super().get_config()
+        config['units'] = self.units
+        return config
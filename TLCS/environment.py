@@ -0,0 +1,261 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import argparse
+import functools
+import multiprocessing
+import random
+import timeit
+import numpy as np
+import traci
+
+from generator import TrafficGenerator
+from detectors import LANE_GROUPS, CELL_LIMITS, STATE_ORIGIN
+from utils import import_train_configuration, set_sumo
+
+INCOMING_ROADS = ["DR2", "RU1", "UL2", "LD1"]
+PHASES = [0, 1, 2, 3]  # phase of J1 of every action, as in Simulation._set_green_phase
+
+
+def encode_state(lane_ids, lane_positions, num_states):
+    """
+    Cell occupancy state from the lane and position of every car, the same state as Simulation._get_state
+    """
+    state = np.zeros(num_states)
+    groups = np.array([LANE_GROUPS.get(lane_id, -1) for lane_id in lane_ids], dtype=int)
+    cells = np.minimum(np.searchsorted(CELL_LIMITS, STATE_ORIGIN - np.asarray(lane_positions, dtype=float), side='right'), len(CELL_LIMITS) - 1)
+    valid = groups >= 0  # cars crossing the intersection or driving away from it are not in the state
+    state[10 * groups[valid] + cells[valid]] = 1
+    return state
+
+
+class TrafficEnv:
+    def __init__(self, sumo_cmd, TrafficGen, max_steps, green_duration, yellow_duration, num_states, num_actions, label='env_0'):
+        self._sumo_cmd = sumo_cmd
+        self._TrafficGen = TrafficGen
+        self._max_steps = max_steps
+        self._green_duration = green_duration
+        self._yellow_duration = yellow_duration
+        self._num_states = num_states
+        self._num_actions = num_actions
+        self._label = label  # own TraCI connection: several environments can run in the same process
+        self._connection = None
+        self._step = 0
+        self._old_action = -1
+        self._old_total_wait = 0
+        self._waiting_times = {}
+
+
+    def reset(self, seed):
+        """
+        Start an episode with the demand of the seed and return the first state and an info dict
+        """
+        self._TrafficGen.generate_routefile(seed=seed)
+        if self._connection is None:
+            traci.start(self._sumo_cmd, label=self._label)
+            self._connection = traci.getConnection(self._label)
+        else:
+            self._connection.load(self._sumo_cmd[1:])  # same process, network and routes reloaded
+        self._step = 0
+        self._old_action = -1
+        self._waiting_times = {}
+        self._old_total_wait = self._collect_waiting_times()
+        return self._get_state(), {'step': self._step}
+
+
+    def step(self, action):
+        """
+        Run one decision: yellow if the phase changes, then the green of the action.
+        Return the next state, the reward (decrease of the waiting time of the cars in the incoming roads), whether the
+        episode is over, and an info dict with the summed queue length of the simulated steps
+        """
+        queue = 0
+        if self._old_action not in (-1, action):
+            queue += self._simulate(self._yellow_duration)  # no yellow phase in the network: a pause, as in Simulation
+        self._connection.trafficlight.setPhase("J1", PHASES[action])
+        queue += self._simulate(self._green_duration)
+        self._old_action = action
+
+        state = self._get_state()
+        total_wait = self._collect_waiting_times()
+        reward = self._old_total_wait - total_wait
+        self._old_total_wait = total_wait
+        return state, reward, self._step >= self._max_steps, {'step': self._step, 'queue': queue}
+
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+    def _simulate(self, steps_todo):
+        """
+        Simulate up to steps_todo steps without going past max_steps, return the summed queue length of the steps
+        """
+        queue = 0
+        for _ in range(min(steps_todo, self._max_steps - self._step)):
+            self._connection.simulationStep()
+            self._step += 1
+            queue += sum(self._connection.edge.getLastStepHaltingNumber(road) for road in INCOMING_ROADS)
+        return queue
+
+
+    def _collect_waiting_times(self):
+        vehicle = self._connection.vehicle
+        for car_id in vehicle.getIDList():
+            if vehicle.getRoadID(car_id) in INCOMING_ROADS:
+                self._waiting_times[car_id] = vehicle.getAccumulatedWaitingTime(car_id)
+            elif car_id in self._waiting_times:  # a car that was tracked has cleared the intersection
+                del self._waiting_times[car_id]
+        return sum(self._waiting_times.values())
+
+
+    def _get_state(self):
+        vehicle = self._connection.vehicle
+        car_list = vehicle.getIDList()
+        return encode_state([vehicle.getLaneID(car_id) for car_id in car_list], [vehicle.getLanePosition(car_id) for car_id in car_list], self._num_states)
+
+
+def make_env(config, index):
+    """
+    Environment of the training configuration with its own route file and TraCI label, picklable for the worker processes
+    """
+    route_file_name = 'env_routes_%i.rou.xml' % index
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'], route_file_name)
+    TrafficGen = TrafficGenerator(config['max_steps'], config['n_cars_generated'], route_file=os.path.join('intersection', route_file_name))
+    return TrafficEnv(sumo_cmd, TrafficGen, config['max_steps'], config['green_duration'], config['yellow_duration'],
+                      config['num_states'], config['num_actions'], label='env_%i' % index)
+
+
+def _worker(connection, env_fn):
+    """
+    Worker process owning one environment, running the commands sent by VectorEnv
+    """
+    env = env_fn()
+    while True:
+        command, argument = connection.recv()
+        if command == 'reset':
+            connection.send(env.reset(argument))
+        elif command == 'step':
+            connection.send(env.step(argument))
+        else:
+            env.close()
+            connection.close()
+            return
+
+
+class VectorEnv:
+    def __init__(self, env_fns, processes=False):
+        self._n_envs = len(env_fns)
+        self._processes = processes
+        self._seeds = None
+        if processes:
+            # every environment in its own process: the SUMO steps of all of them run at the same time
+            context = multiprocessing.get_context('spawn')
+            pipes = [context.Pipe() for _ in env_fns]
+            self._connections = [parent for parent, _ in pipes]
+            self._workers = [context.Process(target=_worker, args=(child, env_fn), daemon=True) for (_, child), env_fn in zip(pipes, env_fns)]
+            for worker in self._workers:
+                worker.start()
+        else:
+            self._envs = [env_fn() for env_fn in env_fns]
+
+
+    def _call(self, command, arguments):
+        if self._processes:
+            for connection, argument in zip(self._connections, arguments):
+                connection.send((command, argument))  # every worker gets its command before any result is read
+            return [connection.recv() for connection in self._connections]
+        return [getattr(env, command)(argument) for env, argument in zip(self._envs, arguments)]
+
+
+    def reset(self, seeds):
+        """
+        Reset every environment with its seed, return the stacked states (n_envs x num_states) and the infos
+        """
+        self._seeds = list(seeds)
+        states, infos = zip(*self._call('reset', self._seeds))
+        return np.stack(states), list(infos)
+
+
+    def step(self, actions):
+        """
+        Step every environment in lockstep with its action. Return stacked states, rewards and done flags, and the infos.
+        An environment whose episode is over is reset right away with its next seed (seed + n_envs): its state is the first
+        state of the new episode, the last state of the finished one is in info['final_state']
+        """
+        states, rewards, dones, infos = (list(values) for values in zip(*self._call('step', [int(action) for action in actions])))
+        finished = [i for i, done in enumerate(dones) if done]
+        if finished:
+            for i in finished:
+                self._seeds[i] += self._n_envs
+                infos[i]['final_state'] = states[i]
+            if self._processes:
+                for i in finished:
+                    self._connections[i].send(('reset', self._seeds[i]))
+                resets = [self._connections[i].recv() for i in finished]
+            else:
+                resets = [self._envs[i].reset(self._seeds[i]) for i in finished]
+            for i, (state, _) in zip(finished, resets):
+                states[i] = state
+        return np.stack(states), np.array(rewards, dtype=float), np.array(dones), infos
+
+
+    def close(self):
+        if self._processes:
+            for connection in self._connections:
+                connection.send(('close', None))
+            for worker in self._workers:
+                worker.join()
+        else:
+            for env in self._envs:
+                env.close()
+
+
+    @property
+    def n_envs(self):
+        return self._n_envs
+
+
+def rollout(Vec, Model, n_decisions, seeds, epsilon=0.0, Memory=None, num_actions=4):
+    """
+    Run n_decisions lockstep decisions of all the environments, the actions of all of them coming from one predict_batch
+    call (epsilon-greedy). The transitions are added to the memory if one is given. Return the decisions per second
+    """
+    states, _ = Vec.reset(seeds)
+    start_time = timeit.default_timer()
+    for _ in range(n_decisions):
+        actions = np.argmax(Model.predict_batch(states), axis=1)
+        for i in range(Vec.n_envs):
+            if random.random() < epsilon:
+                actions[i] = random.randint(0, num_actions - 1)
+        next_states, rewards, dones, infos = Vec.step(actions)
+        if Memory is not None:
+            for i in range(Vec.n_envs):
+                Memory.add_sample((states[i], actions[i], rewards[i], infos[i]['final_state'] if dones[i] else next_states[i]))
+        states = next_states
+    return n_decisions * Vec.n_envs / (timeit.default_timer() - start_time)
+
+
+if __name__ == "__main__":
+
+    from stress_test import RandomModel
+
+    parser = argparse.ArgumentParser(description="Decision throughput of the vectorized environment, in process and with worker processes")
+    parser.add_argument('--envs', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--decisions', type=int, default=50, help="lockstep decisions of every run")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = import_train_configuration(config_file='training_settings.ini')
+    Model = RandomModel(config['num_states'], config['num_actions'], config['num_layers'], config['width_layers'])
+
+    print("\n%6s %12s %14s" % ('envs', 'mode', 'decisions/s'))
+    for n_envs in args.envs:
+        for processes in (False, True):
+            Vec = VectorEnv([functools.partial(make_env, config, i) for i in range(n_envs)], processes=processes)
+            throughput = rollout(Vec, Model, args.decisions, [args.seed + i for i in range(n_envs)], num_actions=config['num_actions'])
+            Vec.close()
+            print("%6i %12s %14.1f" % (n_envs, 'processes' if processes else 'in process', throughput))
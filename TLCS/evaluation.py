@@ -1,77 +1,253 @@
+import sys
+import glob
+import argparse
+import warnings
 import numpy as np
 
-def load_data(filepath):
-    """Load data from text file"""
-    with open(filepath, 'r') as f:
-        return np.array([float(line.strip()) for line in f if line.strip()])
-
-def calculate_metrics(queue_data, name="Model"):
-    """Calculate evaluation metrics"""
-    metrics = {
-        'name': name,
-        'avg_queue': np.mean(queue_data),
-        'median_queue': np.median(queue_data),
-        'std_queue': np.std(queue_data),
-        'min_queue': np.min(queue_data),
-        'max_queue': np.max(queue_data),
+PERCENTILES = (5, 25, 75, 95)
+
+DEFAULT_RUNS = [
+    'RL Agent (DQN)=models/model_15/test/plot_queue_data.txt',
+    'Fixed-Time Baseline=comparison/fixed_time_baseline_2000/plot_queue_data.txt',
+]
+
+
+def parse_run_specs(specs):
+    """
+    Turn 'label=glob' specs into (label, files) pairs: every file matched by the glob is one seed of the controller
+    """
+    runs = []
+    for spec in specs:
+        label, pattern = spec.split('=', 1)
+        files = sorted(glob.glob(pattern))
+        if not files:
+            sys.exit("No data file matches: " + pattern)
+        runs.append((label, files))
+    return runs
+
+
+def load_runs(runs):
+    """
+    Load N controllers x M seeds into one 2-D array (rows: controller-major, then seed; columns: steps).
+    All files are parsed in a single numpy conversion, shorter series and missing seeds are padded with nan
+    """
+    labels = [label for label, _ in runs]
+    n_seeds = max(len(files) for _, files in runs)
+    files = [path for _, paths in runs for path in paths]
+    rows = np.array([i * n_seeds + j for i, (_, paths) in enumerate(runs) for j in range(len(paths))])
+
+    texts = []
+    for path in files:
+        with open(path, 'r') as file:
+            texts.append(file.read())
+    lengths = np.array([len(text.split()) for text in texts])
+    values = np.array(" ".join(texts).split(), dtype=float)
+
+    starts = np.cumsum(lengths) - lengths
+    row_index = np.repeat(rows, lengths)
+    col_index = np.arange(len(values)) - np.repeat(starts, lengths)
+    data = np.full((len(labels) * n_seeds, lengths.max()), np.nan)
+    data[row_index, col_index] = values
+    return labels, n_seeds, data
+
+
+def describe(data):
+    """
+    Compute the statistics of every row of the data at once, ignoring the nan padding
+    """
+    stats = {
+        'mean': np.nanmean(data, axis=1),
+        'median': np.nanmedian(data, axis=1),
+        'std': np.nanstd(data, axis=1),
+        'min': np.nanmin(data, axis=1),
+        'max': np.nanmax(data, axis=1),
     }
-    return metrics
-
-def print_metrics(metrics):
-    """Print metrics in a formatted table"""
-    print(f"\n{'='*60}")
-    print(f"EVALUATION METRICS: {metrics['name']}")
-    print(f"{'='*60}")
-    print(f"{'Metric':<30} {'Value':<20}")
-    print(f"{'-'*60}")
-    print(f"{'Average Queue Length':<30} {metrics['avg_queue']:.2f} vehicles")
-    print(f"{'Median Queue Length':<30} {metrics['median_queue']:.2f} vehicles")
-    print(f"{'Standard Deviation':<30} {metrics['std_queue']:.2f}")
-    print(f"{'Minimum Queue Length':<30} {metrics['min_queue']:.2f} vehicles")
-    print(f"{'Maximum Queue Length':<30} {metrics['max_queue']:.2f} vehicles")
-    print(f"{'='*60}\n")
-
-def compare_models(baseline_metrics, model_metrics):
-    """Compare model against baseline and show improvement"""
-    baseline_avg = baseline_metrics['avg_queue']
-    model_avg = model_metrics['avg_queue']
-    
-    improvement = ((baseline_avg - model_avg) / baseline_avg) * 100
-    difference = baseline_avg - model_avg
-    
-    print("\n" + "="*60)
-    print(f"COMPARISON: {model_metrics['name']} vs {baseline_metrics['name']}")
-    print("="*60)
-    print(f"{baseline_metrics['name']} Average:     {baseline_avg:.2f} vehicles")
-    print(f"{model_metrics['name']} Average:       {model_avg:.2f} vehicles")
-    print(f"Difference:                {difference:+.2f} vehicles")
-    
-    if improvement > 0:
-        print(f"\n{'IMPROVEMENT:':>30} {improvement:.2f}%")
-        print(f"{'':>30} ✓ Queue decreased by {improvement:.2f}%")
+    for p, values in zip(PERCENTILES, np.nanpercentile(data, PERCENTILES, axis=1)):
+        stats['p%i' % p] = values
+    return stats
+
+
+def paired_units(data, n_seeds, reference_index, block_length):
+    """
+    Return the paired differences (controller - reference) used for inference, one row per controller.
+    With several seeds the unit is the per-seed mean; with one seed the steps are autocorrelated, so the unit
+    is the mean of non-overlapping blocks of block_length steps of the step-by-step difference
+    """
+    n_controllers = data.shape[0] // n_seeds
+    runs = data.reshape(n_controllers, n_seeds, -1)
+    if n_seeds > 1:
+        seed_means = np.nanmean(runs, axis=2)
+        return seed_means - seed_means[reference_index]
+
+    differences = runs[:, 0, :] - runs[reference_index, 0, :]
+    n_blocks = differences.shape[1] // block_length
+    blocks = differences[:, :n_blocks * block_length].reshape(n_controllers, n_blocks, block_length)
+    return np.nanmean(blocks, axis=2)
+
+
+def bootstrap_ci(units, n_resamples, confidence, rng):
+    """
+    Percentile bootstrap confidence interval of the mean of every row, with all the resamples drawn in one array
+    """
+    n_units = units.shape[1]
+    indices = rng.integers(0, n_units, size=(n_resamples, n_units))
+    means = np.nanmean(units[:, indices], axis=2)  # controllers x resamples
+    alpha = (1 - confidence) / 2
+    low, high = np.nanpercentile(means, [100 * alpha, 100 * (1 - alpha)], axis=1)
+    return low, high
+
+
+def sign_flip_test(units, n_permutations, rng):
+    """
+    Two-sided paired permutation test of every row: under the null hypothesis of no difference, the sign of each
+    paired difference is exchangeable. Exact when all the sign combinations fit in n_permutations
+    """
+    n_units = units.shape[1]
+    if 2 ** n_units <= n_permutations:
+        signs = 1 - 2 * ((np.arange(2 ** n_units)[:, None] >> np.arange(n_units)) & 1)
     else:
-        print(f"\n{'DEGRADATION:':>30} {abs(improvement):.2f}%")
-        print(f"{'':>30} ✗ Queue increased by {abs(improvement):.2f}%")
-    
-    print("="*60 + "\n")
+        signs = rng.choice([-1, 1], size=(n_permutations, n_units))
+    observed = np.abs(np.nanmean(units, axis=1))
+    permuted = np.abs(np.nanmean(units[:, None, :] * signs[None, :, :], axis=2))  # controllers x permutations
+    return (np.sum(permuted >= observed[:, None] - 1e-12, axis=1) + 1) / (signs.shape[0] + 1)
+
+
+def evaluate(labels, n_seeds, data, reference, n_resamples=2000, confidence=0.95, block_length=100, seed=0):
+    """
+    Compute the statistics of every controller and its paired comparison against the reference controller
+    """
+    rng = np.random.default_rng(seed)
+    reference_index = labels.index(reference)
+    n_controllers = len(labels)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-nan rows of the seeds missing for some controller are expected
+        run_stats = describe(data)
+        controller_stats = {name: np.nanmean(values.reshape(n_controllers, n_seeds), axis=1) for name, values in run_stats.items()}
+
+        units = paired_units(data, n_seeds, reference_index, block_length)
+        diff_low, diff_high = bootstrap_ci(units, n_resamples, confidence, rng)
+        p_values = sign_flip_test(units, n_resamples, rng)
+        mean_series = np.nanmean(data.reshape(n_controllers, n_seeds, -1), axis=1)
+
+    reference_mean = controller_stats['mean'][reference_index]
+    return {
+        'labels': labels,
+        'reference': reference,
+        'n_seeds': n_seeds,
+        'confidence': confidence,
+        'stats': controller_stats,
+        'difference': np.nanmean(units, axis=1),
+        'difference_ci': (diff_low, diff_high),
+        'improvement': (reference_mean - controller_stats['mean']) / reference_mean * 100,
+        'p_value': p_values,
+        'mean_series': mean_series,
+    }
+
+
+def format_table(result):
+    """
+    Format the statistics and the comparison of every controller as a text table
+    """
+    columns = ['mean', 'median', 'std'] + ['p%i' % p for p in PERCENTILES] + ['min', 'max']
+    label_width = max(len(label) for label in result['labels']) + 2
+    lines = ['=' * 60, 'EVALUATION METRICS: queue length (vehicles), %i seed(s) per controller' % result['n_seeds'], '=' * 60]
+    lines.append(''.join(['%-*s' % (label_width, 'Controller')] + ['%9s' % name for name in columns]))
+    for i, label in enumerate(result['labels']):
+        lines.append(''.join(['%-*s' % (label_width, label)] + ['%9.2f' % result['stats'][name][i] for name in columns]))
+
+    lines += ['', '=' * 60, 'COMPARISON against %s (%i%% CI, paired)' % (result['reference'], round(result['confidence'] * 100)), '=' * 60]
+    lines.append('%-*s%12s%24s%14s%10s' % (label_width, 'Controller', 'Difference', 'CI', 'Improvement', 'p-value'))
+    low, high = result['difference_ci']
+    for i, label in enumerate(result['labels']):
+        if label == result['reference']:
+            continue
+        lines.append('%-*s%+12.2f%24s%+13.2f%%%10.4f' % (label_width, label, result['difference'][i], '[%+.2f, %+.2f]' % (low[i], high[i]),
+                                                      result['improvement'][i], result['p_value'][i]))
+    return "\n".join(lines)
+
+
+def plot_evaluation(result, plot_file, dpi=150, max_points=2000):
+    """
+    Save one composite figure: queue over time, mean queue with the confidence interval of the difference, queue distribution
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from visualization import decimate
+
+    labels = result['labels']
+    stats = result['stats']
+    reference_index = labels.index(result['reference'])
+    low, high = result['difference_ci']
+    reference_mean = stats['mean'][reference_index]
+
+    fig = Figure(figsize=(20, 5.5))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(1, 3)
+
+    for i, label in enumerate(labels):
+        x, y = decimate(result['mean_series'][i][~np.isnan(result['mean_series'][i])], max_points)
+        axes[0].plot(x, y, label=label, linewidth=1.2, alpha=0.8)
+    axes[0].set_xlabel('Simulation Step', fontsize=11)
+    axes[0].set_ylabel('Queue Length (vehicles)', fontsize=11)
+    axes[0].set_title('Queue Length Over Time', fontsize=12, fontweight='bold')
+    axes[0].legend(fontsize=10)
+    axes[0].grid(True, alpha=0.3)
+
+    # error bars: CI of the paired difference, shifted on the mean of the reference
+    errors = np.array([stats['mean'] - (reference_mean + low), (reference_mean + high) - stats['mean']])
+    errors[:, reference_index] = 0
+    bars = axes[1].bar(labels, stats['mean'], yerr=np.clip(errors, 0, None), capsize=6, alpha=0.7, edgecolor='black', linewidth=1.5,
+                       color=['#e74c3c' if i == reference_index else '#2ecc71' for i in range(len(labels))])
+    for i, bar in enumerate(bars):
+        text = '%.2f' % stats['mean'][i]
+        if i != reference_index:
+            text += '\n%+.1f%% (p=%.3f)' % (result['improvement'][i], result['p_value'][i])
+        axes[1].text(bar.get_x() + bar.get_width() / 2., bar.get_height(), text, ha='center', va='bottom', fontsize=10, fontweight='bold')
+    axes[1].set_ylabel('Average Queue Length (vehicles)', fontsize=11)
+    axes[1].set_title('Average Queue Length Comparison', fontsize=12, fontweight='bold')
+    axes[1].grid(True, alpha=0.3, axis='y')
+
+    # distribution from the precomputed percentiles, no pass over the raw data
+    boxes = [{'label': label, 'med': stats['median'][i], 'q1': stats['p25'][i], 'q3': stats['p75'][i],
+              'whislo': stats['p5'][i], 'whishi': stats['p95'][i], 'mean': stats['mean'][i]} for i, label in enumerate(labels)]
+    axes[2].bxp(boxes, showfliers=False, showmeans=True)
+    axes[2].set_ylabel('Queue Length (vehicles)', fontsize=11)
+    axes[2].set_title('Queue Length Distribution (p5-p95)', fontsize=12, fontweight='bold')
+    axes[2].grid(True, alpha=0.3, axis='y')
+
+    fig.tight_layout()
+    fig.savefig(plot_file, dpi=dpi, bbox_inches='tight')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the queue length of several controllers over several seeds")
+    parser.add_argument('runs', nargs='*', default=DEFAULT_RUNS, help="label=glob of the queue data files, one file per seed")
+    parser.add_argument('--reference', default=None, help="label of the controller the others are compared to (default: the last one)")
+    parser.add_argument('--resamples', type=int, default=2000, help="bootstrap resamples and permutations")
+    parser.add_argument('--block-length', type=int, default=100, help="steps per block when there is a single seed")
+    parser.add_argument('--table', default=None, help="save the table to this txt file")
+    parser.add_argument('--plot', default=None, help="save the composite figure to this png file")
+    args = parser.parse_args(argv)
+
+    runs = parse_run_specs(args.runs)
+    labels, n_seeds, data = load_runs(runs)
+    reference = args.reference if args.reference is not None else labels[-1]
+    if reference not in labels:
+        sys.exit("Unknown reference controller: " + reference)
+
+    result = evaluate(labels, n_seeds, data, reference, n_resamples=args.resamples, block_length=args.block_length)
+    table = format_table(result)
+    print(table)
+
+    if args.table:
+        with open(args.table, "w") as file:
+            file.write(table + "\n")
+    if args.plot:
+        plot_evaluation(result, args.plot)
+        print("Saved:", args.plot)
+    return result
+
 
-# Main evaluation
 if __name__ == "__main__":
-    print("\n" + "="*60)
-    print("MODEL EVALUATION")
-    print("="*60)
-    
-    # Load Fixed-Time baseline
-    fixed_queue = load_data('comparison/fixed_time_baseline_2000/plot_queue_data.txt')
-    fixed_metrics = calculate_metrics(fixed_queue, "Fixed-Time Baseline")
-    print_metrics(fixed_metrics)
-    
-    # Load RL Agent
-    rl_queue = load_data('models/model_15/test/plot_queue_data.txt')
-    rl_metrics = calculate_metrics(rl_queue, "RL Agent (DQN)")
-    print_metrics(rl_metrics)
-    
-    # Compare
-    compare_models(fixed_metrics, rl_metrics)
-    
-    print("✓ Evaluation complete!")
\ No newline at end of file
+    main()
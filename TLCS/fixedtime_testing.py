@@ -2,24 +2,33 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import sys
+import argparse
+import subprocess
 import traci
 import numpy as np
 import timeit
 from shutil import copyfile
+from concurrent.futures import ProcessPoolExecutor
 
 from generator import TrafficGenerator
+from sumo_session import SumoSession
+from snapshots import SnapshotCache
 from visualization import Visualization
+from metrics import StreamingSeries
 from utils import import_test_configuration, set_sumo, set_test_path
+from sumo_outputs import write_edgedata_additional, ingest_edgedata, ingest_tripinfo, ingest_summary
 
 
 class FixedTimeSimulation:
-    def __init__(self, TrafficGen, sumo_cmd, max_steps):
+    def __init__(self, TrafficGen, Sumo, max_steps, idle_fast_forward=False, RewardSeries=None, QueueSeries=None):
         self._TrafficGen = TrafficGen
-        self._sumo_cmd = sumo_cmd
+        self._Sumo = Sumo
         self._max_steps = max_steps
-        self._reward_episode = []
-        self._queue_length_episode = []
+        self._reward_episode = RewardSeries if RewardSeries is not None else []  # a StreamingSeries keeps constant memory
+        self._queue_length_episode = QueueSeries if QueueSeries is not None else []
         self._step = 0
+        self._idle_fast_forward = idle_fast_forward
         
     def run(self, episode):
         """
@@ -29,15 +38,24 @@ class FixedTimeSimulation:
         
         # Generate the same traffic pattern
         self._TrafficGen.generate_routefile(seed=episode)
-        traci.start(self._sumo_cmd)
+        self._start_step = self._Sumo.start_episode()  # 0, or the warm start step
         print("Simulating with Fixed-Time Control...")
         
-        self._step = 0
+        self._step = self._start_step
         self._waiting_times = {}
-        old_total_wait = 0
+        old_total_wait = self._collect_waiting_times()  # 0 on an empty network, the waiting time so far after a warm start
         
         # Let SUMO run with its default fixed-time control
         while self._step < self._max_steps:
+            # with an empty network, jump to the next departure or end the episode, padding the metrics with the 0s of the skipped steps
+            if self._idle_fast_forward:
+                idle_until = self._Sumo.fast_forward_idle(self._step, self._max_steps, self._TrafficGen.next_departure(self._step))
+                self._reward_episode.extend([0] * (idle_until - self._step))
+                self._queue_length_episode.extend([0] * (idle_until - self._step))
+                self._step = idle_until
+                if self._step >= self._max_steps:
+                    break
+
             traci.simulationStep()
             self._step += 1
             
@@ -51,7 +69,7 @@ class FixedTimeSimulation:
             
             old_total_wait = current_total_wait
         
-        traci.close()
+        self._Sumo.end_episode()
         simulation_time = round(timeit.default_timer() - start_time, 1)
         
         return simulation_time
@@ -87,9 +105,82 @@ class FixedTimeSimulation:
         return self._reward_episode
 
 
+def run_native_baseline(sumo_cmd, max_steps, n_cars_generated, seed, output_path):
+    """
+    Run one fixed-time baseline without TraCI: SUMO runs straight through writing its own summary, tripinfo and per-step
+    edge data outputs, which are then ingested as streams. Returns the statistics of the run
+    """
+    os.makedirs(output_path, exist_ok=True)
+    route_file = os.path.join(output_path, 'routes.rou.xml')
+    TrafficGenerator(max_steps, n_cars_generated, route_file=route_file).generate_routefile(seed=seed)
+
+    additional_file = os.path.join(output_path, 'edgedata.add.xml')
+    edgedata_file = os.path.join(output_path, 'edgedata.xml')
+    summary_file = os.path.join(output_path, 'summary.xml')
+    tripinfo_file = os.path.join(output_path, 'tripinfo.xml')
+    write_edgedata_additional(additional_file, edgedata_file)
+
+    start_time = timeit.default_timer()
+    with open(os.path.join(output_path, 'sumo.log'), "w") as log:
+        subprocess.run(sumo_cmd + ["-r", route_file, "--end", str(max_steps), "--additional-files", additional_file,
+                                   "--summary-output", summary_file, "--tripinfo-output", tripinfo_file],
+                       stdout=log, stderr=subprocess.STDOUT, check=True)
+    simulation_time = timeit.default_timer() - start_time
+
+    stats = {'seed': seed, 'n_cars_generated': n_cars_generated, 'simulation_time': simulation_time}
+    stats.update(ingest_edgedata(edgedata_file, os.path.join(output_path, 'plot_queue_data.txt')))
+    stats.update(ingest_tripinfo(tripinfo_file))
+    stats.update(ingest_summary(summary_file))
+    with open(os.path.join(output_path, 'stats.txt'), "w") as file:
+        for name, value in stats.items():
+            file.write("%s\t%s\n" % (name, value))
+    return stats
+
+
+def run_native_baselines(config, seeds, cars, parallel):
+    """
+    Run a native fixed-time baseline for every seed and demand, several SUMO processes at the same time
+    """
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'])
+    runs = [(seed, n_cars) for seed in seeds for n_cars in cars]
+    output_paths = [os.path.join('comparison', 'fixed_time_native', 'seed_%i_cars_%i' % (seed, n_cars)) for seed, n_cars in runs]
+
+    print('\n----- Native Fixed-Time Baselines:', len(runs), 'runs,', parallel, 'in parallel')
+    start_time = timeit.default_timer()
+    with ProcessPoolExecutor(max_workers=parallel) as executor:
+        futures = [executor.submit(run_native_baseline, sumo_cmd, config['max_steps'], n_cars, seed, output_path)
+                   for (seed, n_cars), output_path in zip(runs, output_paths)]
+        results = [future.result() for future in futures]
+    print('Total time: %.1f s' % (timeit.default_timer() - start_time))
+
+    print("\n%8s %8s %10s %10s %10s %12s %12s %8s" % ('seed', 'cars', 'sim (s)', 'avg queue', 'max queue', 'avg waiting', 'avg timeloss', 'arrived'))
+    for stats in results:
+        print("%8i %8i %10.1f %10.2f %10i %12.2f %12.2f %8i" % (stats['seed'], stats['n_cars_generated'], stats['simulation_time'], stats['avg_queue'],
+                                                          stats['max_queue'], stats['avg_waiting_time'], stats['avg_time_loss'], stats['arrived']))
+    print("----- Native results saved at:", os.path.join('comparison', 'fixed_time_native'))
+    return results
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fixed-time baseline test")
+    parser.add_argument('--native', action='store_true', help="run SUMO without TraCI and ingest its output files")
+    parser.add_argument('--seeds', type=int, nargs='+', default=None, help="native mode: seeds to run (default: episode_seed)")
+    parser.add_argument('--cars', type=int, nargs='+', default=None, help="native mode: demands to run (default: n_cars_generated)")
+    parser.add_argument('--parallel', type=int, default=os.cpu_count() or 1, help="native mode: SUMO processes at the same time")
+    args = parser.parse_args()
+
     config = import_test_configuration(config_file='testing_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+
+    if args.native:
+        run_native_baselines(
+            config,
+            args.seeds if args.seeds else [config['episode_seed']],
+            args.cars if args.cars else [config['n_cars_generated']],
+            args.parallel
+        )
+        sys.exit(0)
+
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], config['route_file_name'])
     
     # Create output directory
     plot_path = os.path.join(os.getcwd(), 'comparison', 'fixed_time_baseline_2000', '')
@@ -97,18 +188,48 @@ if __name__ == "__main__":
     
     TrafficGen = TrafficGenerator(
         config['max_steps'], 
-        config['n_cars_generated']
+        config['n_cars_generated'],
+        route_file=os.path.join('intersection', config['route_file_name'])
+    )
+    
+    Snapshots = SnapshotCache(
+        os.path.join('intersection', 'snapshots'),
+        config['snapshot_cache_size']
+    )
+
+    Sumo = SumoSession(
+        sumo_cmd,
+        persistent=False,
+        Snapshots=Snapshots,
+        warm_start_step=config['warm_start_step']
     )
     
     Visualization = Visualization(
         plot_path, 
-        dpi=96
+        dpi=96,
+        plot_mode=config['plot_mode'],
+        max_points=config['plot_max_points']
     )
     
+    RewardSeries, QueueSeries = None, None
+    if config['streaming_metrics']:
+        RewardSeries = StreamingSeries(
+            config['metrics_max_points'],
+            histogram=(-1000, 1000, 2000),
+            sink_file=os.path.join(plot_path, 'plot_reward_full_data.txt') if config['full_resolution'] else None
+        )
+        QueueSeries = StreamingSeries(
+            config['metrics_max_points'],
+            sink_file=os.path.join(plot_path, 'plot_queue_full_data.txt') if config['full_resolution'] else None
+        )
+
     Simulation = FixedTimeSimulation(
         TrafficGen,
-        sumo_cmd,
-        config['max_steps']
+        Sumo,
+        config['max_steps'],
+        idle_fast_forward=config['idle_fast_forward'],
+        RewardSeries=RewardSeries,
+        QueueSeries=QueueSeries
     )
     
     print('\n----- Fixed-Time Baseline Test')
@@ -119,15 +240,27 @@ if __name__ == "__main__":
     
     copyfile(src='testing_settings.ini', dst=os.path.join(plot_path, 'testing_settings.ini'))
     
-    Visualization.save_data_and_plot(data=Simulation.reward_episode, filename='reward', xlabel='Step', ylabel='Reward')
-    Visualization.save_data_and_plot(data=Simulation.queue_length_episode, filename='queue', xlabel='Step', ylabel='Queue length (vehicles)')
-    
-    # Calculate statistics
-    avg_queue = np.mean(Simulation.queue_length_episode)
-    max_queue = np.max(Simulation.queue_length_episode)
-    total_reward = np.sum(Simulation.reward_episode)
+    if config['streaming_metrics']:
+        for series, filename, ylabel in ((RewardSeries, 'reward', 'Reward'), (QueueSeries, 'queue', 'Queue length (vehicles)')):
+            series.close()
+            series.save_summary(os.path.join(plot_path, 'plot_%s_stats.txt' % filename))
+            Visualization.save_data_and_plot(data=series.windows.means(), filename=filename, xlabel='Step (x%i)' % series.windows.window, ylabel=ylabel)
+
+        avg_queue = QueueSeries.stats.mean
+        max_queue = QueueSeries.stats.max
+        total_reward = RewardSeries.stats.total
+    else:
+        Visualization.save_data_and_plot(data=Simulation.reward_episode, filename='reward', xlabel='Step', ylabel='Reward')
+        Visualization.save_data_and_plot(data=Simulation.queue_length_episode, filename='queue', xlabel='Step', ylabel='Queue length (vehicles)')
+
+        # Calculate statistics
+        avg_queue = np.mean(Simulation.queue_length_episode)
+        max_queue = np.max(Simulation.queue_length_episode)
+        total_reward = np.sum(Simulation.reward_episode)
     
     print(f"\n----- Statistics:")
     print(f"Average Queue Length: {avg_queue:.2f} vehicles")
     print(f"Maximum Queue Length: {max_queue} vehicles")
-    print(f"Total Cumulative Reward: {total_reward:.0f}")
\ No newline at end of file
+    print(f"Total Cumulative Reward: {total_reward:.0f}")
+
+    Visualization.wait()
@@ -2,9 +2,11 @@ import numpy as np
 import math
 
 class TrafficGenerator:
-    def __init__(self, max_steps, n_cars_generated):
+    def __init__(self, max_steps, n_cars_generated, route_file='intersection/episode_routes.rou.xml'):
         self._n_cars_generated = n_cars_generated  # how many cars per episode
         self._max_steps = max_steps
+        self._route_file = route_file
+        self._car_gen_steps = np.array([])
 
     def generate_routefile(self, seed):
         """
@@ -28,9 +30,10 @@ class TrafficGenerator:
             car_gen_steps = np.append(car_gen_steps, ((max_new - min_new) / (max_old - min_old)) * (value - max_old) + max_new)
 
         car_gen_steps = np.rint(car_gen_steps)  # round every value to int -> effective steps when a car will be generated
+        self._car_gen_steps = car_gen_steps  # sorted, like the timings
 
         # produce the file for cars generation, one car per line
-        with open("intersection/episode_routes.rou.xml", "w") as routes:
+        with open(self._route_file, "w") as routes:
             print("""<routes>
     <vType accel="1.0" decel="4.5" id="standard_car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5" />
 
@@ -98,4 +101,17 @@ class TrafficGenerator:
                         # West to South (LD1 to DL2) - Right turn
                         print('    <vehicle id="LD1_DL2_%i" type="standard_car" route="LD1_DL2" depart="%s" departLane="random" departSpeed="10" />' % (car_counter, step), file=routes)
 
-            print("</routes>", file=routes)
\ No newline at end of file
+            print("</routes>", file=routes)
+
+
+    def next_departure(self, step):
+        """
+        Return the first step after the given one when a car is generated, None if no car is generated any more
+        """
+        i = np.searchsorted(self._car_gen_steps, step, side='right')
+        return self._car_gen_steps[i] if i < len(self._car_gen_steps) else None
+
+
+    @property
+    def route_file(self):
+        return self._route_file
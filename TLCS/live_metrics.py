@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import numbers
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import traci.connection
+
+METRIC_PREFIX = 'tlcs_'
+
+
+class TraciCallCounter:
+    def __init__(self):
+        self._calls = 0
+        self._send_exact = None
+
+
+    def install(self):
+        """
+        Count every round trip to SUMO: the send method of the TraCI connections is wrapped, one integer increment per call
+        """
+        if self._send_exact is not None:
+            return
+        counter = self
+        send_exact = traci.connection.Connection._sendExact
+
+        def counted_send_exact(connection):
+            counter._calls += 1
+            return send_exact(connection)
+
+        self._send_exact = send_exact
+        traci.connection.Connection._sendExact = counted_send_exact
+
+
+    def uninstall(self):
+        if self._send_exact is not None:
+            traci.connection.Connection._sendExact = self._send_exact
+            self._send_exact = None
+
+
+    @property
+    def calls(self):
+        return self._calls
+
+
+def process_rss():
+    """
+    Resident memory of the process in bytes, from /proc on Linux, else the peak resident memory
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # kilobytes on Linux, bytes on macOS
+
+
+class LiveMetrics:
+    def __init__(self, port=0, log_file=None):
+        self._values = {}
+        self._log_file = log_file
+        self._server = None
+        if port:
+            self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+
+    def _handler(self):
+        live_metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = live_metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # no line on the console for every scrape
+
+        return MetricsHandler
+
+
+    def update(self, **values):
+        """
+        Publish the values of the episode: the endpoint serves the new snapshot from now on, the log gets one json line.
+        Called once per episode, the simulation and training loops are not touched
+        """
+        values = {name: value.item() if hasattr(value, 'item') else value for name, value in values.items()}  # numpy scalars
+        values.update(timestamp=time.time(), rss_bytes=process_rss())
+        self._values = values  # replaced as a whole: the server thread never reads a half-updated snapshot
+        if self._log_file is not None:
+            with open(self._log_file, "a") as file:
+                file.write(json.dumps(values) + "\n")
+
+
+    def prometheus_text(self):
+        """
+        The last snapshot in the Prometheus text exposition format, one gauge per numeric value
+        """
+        lines = []
+        for name, value in self._values.items():
+            if isinstance(value, numbers.Real) and not isinstance(value, bool):
+                lines.append('# TYPE %s%s gauge' % (METRIC_PREFIX, name))
+                lines.append('%s%s %r' % (METRIC_PREFIX, name, float(value)))
+        return "\n".join(lines) + "\n"
+
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
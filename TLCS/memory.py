@@ -1,4 +1,5 @@
 import random
+import numpy as np
 
 class Memory:
     def __init__(self, size_max, size_min):
@@ -29,8 +30,39 @@ class Memory:
             return random.sample(self._samples, n)  # get "batch size" number of samples
 
 
+    def get_all_samples(self):
+        """
+        Get every sample in the memory, or none if the memory is not full enough yet
+        """
+        if self._size_now() < self._size_min:
+            return []
+        return list(self._samples)
+
+
     def _size_now(self):
         """
         Check how full the memory is
         """
-        return len(self._samples)
\ No newline at end of file
+        return len(self._samples)
+
+
+    @property
+    def size(self):
+        return self._size_now()
+
+
+def n_step_samples(samples, gamma, n):
+    """
+    Turn the (state, action, reward, next_state) samples of one episode, in order, into n-step samples
+    (state, action, n-step return, state n decisions later, discount), computed for the whole episode with array operations.
+    Near the end of the episode the return sums the rewards left and the discount is gamma^(decisions summed), the last
+    next state still being bootstrapped: the episode ends on the step limit, not on a terminal state
+    """
+    rewards = np.array([sample[2] for sample in samples], dtype=float)
+    n_samples = len(rewards)
+    windows = np.lib.stride_tricks.sliding_window_view(np.concatenate([rewards, np.zeros(n - 1)]), n)  # rewards t .. t+n-1
+    returns = windows @ gamma ** np.arange(n)
+    steps = np.minimum(n, n_samples - np.arange(n_samples))  # rewards really summed
+    discounts = gamma ** steps
+    last = np.arange(n_samples) + steps - 1
+    return [(samples[t][0], samples[t][1], returns[t], samples[last[t]][3], discounts[t]) for t in range(n_samples)]
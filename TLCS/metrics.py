@@ -0,0 +1,210 @@
+import numpy as np
+
+
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self._mean = 0.0
+        self._m2 = 0.0  # sum of squared deviations from the mean (Welford)
+
+
+    def add(self, value, n=1):
+        """
+        Add a value, n times: the repeated values are merged in one step (Chan et al.), e.g. the 0 queues of skipped steps
+        """
+        count = self.count + n
+        delta = value - self._mean
+        self._mean += delta * n / count
+        self._m2 += delta * delta * self.count * n / count
+        self.count = count
+        self.total += value * n
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+    @property
+    def variance(self):
+        return self._m2 / self.count if self.count else 0.0
+
+
+    @property
+    def std(self):
+        return self.variance ** 0.5
+
+
+class Histogram:
+    def __init__(self, low, high, n_buckets):
+        self._edges = np.linspace(low, high, n_buckets + 1)
+        self._counts = np.zeros(n_buckets + 2, dtype=np.int64)  # first and last bucket: below low, above high
+
+
+    def add(self, value, n=1):
+        self._counts[np.searchsorted(self._edges, value, side='right')] += n
+
+
+    def quantile(self, q):
+        """
+        Approximate quantile, linear inside the bucket it falls in; values out of [low, high] are clamped to the limits
+        """
+        total = self._counts.sum()
+        if total == 0:
+            return 0.0
+        cumulative = np.cumsum(self._counts)
+        bucket = int(np.searchsorted(cumulative, q * total, side='left'))
+        if bucket == 0:
+            return self._edges[0]
+        if bucket == len(self._counts) - 1:
+            return self._edges[-1]
+        before = cumulative[bucket - 1]
+        share = (q * total - before) / self._counts[bucket]
+        return self._edges[bucket - 1] + share * (self._edges[bucket] - self._edges[bucket - 1])
+
+
+class WindowedSeries:
+    def __init__(self, max_points=2000):
+        self._max_points = max(max_points - max_points % 2, 2)  # even, the windows are merged by pairs
+        self._window = 1
+        self._sums = np.zeros(self._max_points)
+        self._mins = np.zeros(self._max_points)
+        self._maxs = np.zeros(self._max_points)
+        self._n_windows = 0
+        self._current = RunningStats()
+
+
+    def add(self, value):
+        """
+        Add a value to the current window. When max_points windows are full, every pair of windows is merged and the
+        window doubles: the memory stays constant whatever the length of the series
+        """
+        self._current.add(value)
+        if self._current.count < self._window:
+            return
+        self._sums[self._n_windows] = self._current.total
+        self._mins[self._n_windows] = self._current.min
+        self._maxs[self._n_windows] = self._current.max
+        self._n_windows += 1
+        self._current = RunningStats()
+        if self._n_windows == self._max_points:
+            self._sums[:self._max_points // 2] = self._sums.reshape(-1, 2).sum(axis=1)
+            self._mins[:self._max_points // 2] = self._mins.reshape(-1, 2).min(axis=1)
+            self._maxs[:self._max_points // 2] = self._maxs.reshape(-1, 2).max(axis=1)
+            self._n_windows = self._max_points // 2
+            self._window *= 2
+
+
+    def means(self):
+        """
+        Mean of every full window, then of the current partial window
+        """
+        means = self._sums[:self._n_windows] / self._window
+        return np.append(means, self._current.mean) if self._current.count else means
+
+
+    def mins(self):
+        return np.append(self._mins[:self._n_windows], self._current.min) if self._current.count else self._mins[:self._n_windows]
+
+
+    def maxs(self):
+        return np.append(self._maxs[:self._n_windows], self._current.max) if self._current.count else self._maxs[:self._n_windows]
+
+
+    @property
+    def window(self):
+        return self._window
+
+
+class ChunkedSink:
+    def __init__(self, file_path, chunk_size=3600):
+        self._file_path = file_path
+        self._chunk_size = chunk_size
+        self._buffer = []
+        open(file_path, "w").close()
+
+
+    def add(self, value):
+        self._buffer.append(value)
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Append the buffered values to the file, one value per line like Visualization.save_data_and_plot
+        """
+        if self._buffer:
+            with open(self._file_path, "a") as file:
+                file.write("".join("%s\n" % value for value in self._buffer))
+            self._buffer = []
+
+
+class StreamingSeries:
+    def __init__(self, max_points=2000, histogram=(0, 1000, 1000), sink_file=None):
+        self._stats = RunningStats()
+        self._histogram = Histogram(*histogram)
+        self._windows = WindowedSeries(max_points)
+        self._sink = ChunkedSink(sink_file) if sink_file else None  # full resolution, only when asked for
+
+
+    def append(self, value):
+        """
+        Aggregate a value of the series in constant memory, in place of list.append
+        """
+        self._stats.add(value)
+        self._histogram.add(value)
+        self._windows.add(value)
+        if self._sink is not None:
+            self._sink.add(value)
+
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+
+    def __len__(self):
+        return self._stats.count
+
+
+    def close(self):
+        if self._sink is not None:
+            self._sink.flush()
+
+
+    def summary(self):
+        """
+        Stats of the whole series, the percentiles coming from the histogram
+        """
+        return {
+            'count': self._stats.count,
+            'mean': self._stats.mean,
+            'std': self._stats.std,
+            'min': self._stats.min,
+            'max': self._stats.max,
+            'p50': self._histogram.quantile(0.5),
+            'p95': self._histogram.quantile(0.95),
+            'p99': self._histogram.quantile(0.99),
+        }
+
+
+    def save_summary(self, file_path):
+        with open(file_path, "w") as file:
+            for name, value in self.summary().items():
+                file.write("%s\t%s\n" % (name, value))
+
+
+    @property
+    def stats(self):
+        return self._stats
+
+
+    @property
+    def windows(self):
+        return self._windows
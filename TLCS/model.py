@@ -1,46 +1,66 @@
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL']='2'  # kill warning about tensorflow
-import tensorflow as tf
+import json
 import numpy as np
 import sys
+from collections import OrderedDict
 
-from tensorflow import keras
-from tensorflow.keras import layers
-from tensorflow.keras import losses
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.utils import plot_model
-from tensorflow.keras.models import load_model
+FIT_BATCH_SIZE = 32  # minibatch size of model.fit when none is given, as in train_batch
+
+# tensorflow/keras are imported inside the methods that need them: importing this module
+# (e.g. from testing_main.py with a weights file available) does not pay the tensorflow startup cost
 
 
 class TrainModel:
-    def __init__(self, num_layers, width, batch_size, learning_rate, input_dim, output_dim):
+    def __init__(self, num_layers, width, batch_size, learning_rate, input_dim, output_dim, q_cache_size=0, sparse_input=False, dueling=False):
         self._input_dim = input_dim
         self._output_dim = output_dim
         self._batch_size = batch_size
         self._learning_rate = learning_rate
+        self._sparse_input = sparse_input
+        self._dueling = dueling
         self._model = self._build_model(num_layers, width)
+        self._train_step = None  # compiled by train_replay when first needed
+        self._q_cache = QValueCache(q_cache_size) if q_cache_size > 0 else None
 
 
     def _build_model(self, num_layers, width):
         """
-        Build and compile a fully connected deep neural network
+        Build and compile a fully connected deep neural network. With sparse input, the first layer only sums the
+        weights of the occupied cells of the state, with the same weights and outputs as the dense layer.
+        With a dueling head, the output layer has separate state value and action advantage streams
         """
+        from tensorflow import keras
+        from tensorflow.keras import layers
+        from tensorflow.keras import losses
+        from tensorflow.keras.optimizers import Adam
+
         inputs = keras.Input(shape=(self._input_dim,))
-        x = layers.Dense(width, activation='relu')(inputs)
+        if self._sparse_input:
+            from sparse_layer import OccupancyEmbeddingBag
+            x = OccupancyEmbeddingBag(width)(inputs)
+        else:
+            x = layers.Dense(width, activation='relu')(inputs)
         for _ in range(num_layers):
             x = layers.Dense(width, activation='relu')(x)
-        outputs = layers.Dense(self._output_dim, activation='linear')(x)
+        if self._dueling:
+            from dueling_layer import DuelingHead
+            outputs = DuelingHead(self._output_dim)(x)
+        else:
+            outputs = layers.Dense(self._output_dim, activation='linear')(x)
 
         model = keras.Model(inputs=inputs, outputs=outputs, name='my_model')
         model.compile(loss=losses.mean_squared_error, optimizer=Adam(learning_rate=self._learning_rate))
         return model
-    
+
 
     def predict_one(self, state):
         """
-        Predict the action values from a single state
+        Predict the action values from a single state, from the q-value cache if the state was seen since the last training
         """
         state = np.reshape(state, [1, self._input_dim])
+        if self._q_cache is not None:
+            return self._q_cache.get(state, lambda: self._model.predict(state))
         return self._model.predict(state)
 
 
@@ -53,16 +73,76 @@ class TrainModel:
 
     def train_batch(self, states, q_sa):
         """
-        Train the nn using the updated q-values
+        Train the nn using the updated q-values and return the training loss
+        """
+        history = self._model.fit(states, q_sa, epochs=1, verbose=0)
+        if self._q_cache is not None:
+            self._q_cache.clear()  # the cached action values come from the old weights
+        return history.history['loss'][-1]
+
+
+    def train_replay(self, states, actions, rewards, next_states, discounts, batch_indices):
+        """
+        Train on all the batches of an episode in one pass: the batches (rows of indices into the sample arrays) are
+        gathered by a prefetching tf.data pipeline and the targets are computed in the graph with the current weights,
+        batch after batch, like predict_batch + train_batch do. The discount of every sample is gamma, or gamma^n for
+        n-step samples. Return the mean training loss of the batches
+        """
+        import tensorflow as tf
+
+        if self._train_step is None:
+            self._train_step = self._build_train_step()
+
+        memory = tuple(tf.constant(array) for array in (states.astype(np.float32), actions.astype(np.int32), rewards.astype(np.float32),
+                                                        next_states.astype(np.float32), discounts.astype(np.float32)))
+        dataset = tf.data.Dataset.from_tensor_slices(batch_indices.astype(np.int32))
+        dataset = dataset.map(lambda indices: tuple(tf.gather(array, indices) for array in memory), num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.prefetch(tf.data.AUTOTUNE)
+
+        losses = [self._train_step(*batch) for batch in dataset]
+        if self._q_cache is not None:
+            self._q_cache.clear()
+        return float(np.mean(losses)) if losses else None
+
+
+    def _build_train_step(self):
+        """
+        Build the compiled training step on one batch, equivalent to predict_batch + train_batch: the targets are Q(state)
+        with the updated action value, then the batch is shuffled and trained in minibatches of the size model.fit uses by default
         """
-        self._model.fit(states, q_sa, epochs=1, verbose=0)
+        import tensorflow as tf
+
+        model = self._model
+        optimizer = self._model.optimizer
+
+        @tf.function
+        def train_step(states, actions, rewards, next_states, discounts):
+            q = model(states, training=False)
+            q_next = model(next_states, training=False)
+            targets = q + tf.one_hot(actions, self._output_dim) * ((rewards + discounts * tf.reduce_max(q_next, axis=1))[:, None] - q)
+
+            order = tf.random.shuffle(tf.range(tf.shape(states)[0]))
+            losses = []
+            for start in range(0, states.shape[0], FIT_BATCH_SIZE):  # static batch size: unrolled when the step is traced
+                indices = order[start:start + FIT_BATCH_SIZE]
+                with tf.GradientTape() as tape:
+                    loss = tf.reduce_mean(tf.square(tf.gather(targets, indices) - model(tf.gather(states, indices), training=True)))
+                gradients = tape.gradient(loss, model.trainable_variables)
+                optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+                losses.append(loss)
+            return tf.reduce_mean(losses)  # mean over the minibatches, like the loss reported by fit
+
+        return train_step
 
 
     def save_model(self, path):
         """
-        Save the current model in the folder as h5 file and a model architecture summary as png
+        Save the current model in the folder as h5 file, as tensorflow-free npz weights and a model architecture summary as png
         """
+        from tensorflow.keras.utils import plot_model
+
         self._model.save(os.path.join(path, 'trained_model.h5'))
+        save_weights(os.path.join(path, 'trained_weights.npz'), extract_weights(self._model))
         plot_model(self._model, to_file=os.path.join(path, 'model_structure.png'), show_shapes=True, show_layer_names=True)
 
 
@@ -81,33 +161,252 @@ class TrainModel:
         return self._batch_size
 
 
+    @property
+    def q_cache(self):
+        return self._q_cache
+
+
+    @property
+    def weights(self):
+        return extract_weights(self._model)
+
+
 class TestModel:
-    def __init__(self, input_dim, model_path):
+    def __init__(self, input_dim, model_path, q_cache_size=0, sparse_input=False):
         self._input_dim = input_dim
-        self._model = self._load_my_model(model_path)
+        self._sparse_input = sparse_input
+        self._weights = self._load_my_model(model_path)
+        self._q_cache = QValueCache(q_cache_size) if q_cache_size > 0 else None
 
 
     def _load_my_model(self, model_folder_path):
         """
-        Load the model stored in the folder specified by the model number, if it exists
+        Load the weights of the model stored in the folder specified by the model number, if it exists.
+        The npz weights file is read without tensorflow, the h5 file is only a fallback for older models
         """
+        weights_file_path = os.path.join(model_folder_path, 'trained_weights.npz')
         model_file_path = os.path.join(model_folder_path, 'trained_model.h5')
-        
-        if os.path.isfile(model_file_path):
-            loaded_model = load_model(model_file_path)
-            return loaded_model
+
+        if os.path.isfile(weights_file_path):
+            return load_weights(weights_file_path)
+        elif os.path.isfile(model_file_path):
+            from tensorflow.keras.models import load_model
+            from sparse_layer import OccupancyEmbeddingBag
+            from dueling_layer import DuelingHead
+            weights = extract_weights(load_model(model_file_path, custom_objects={'OccupancyEmbeddingBag': OccupancyEmbeddingBag, 'DuelingHead': DuelingHead}))
+            try:
+                save_weights(weights_file_path, weights)  # cache the weights, so the next test of this model skips tensorflow
+            except OSError:
+                pass
+            return weights
         else:
             sys.exit("Model number not found")
 
 
     def predict_one(self, state):
         """
-        Predict the action values from a single state
+        Predict the action values from a single state, from the q-value cache if the state was already seen
         """
         state = np.reshape(state, [1, self._input_dim])
-        return self._model.predict(state)
+        if self._q_cache is not None:
+            return self._q_cache.get(state, lambda: forward(self._weights, state, self._sparse_input))
+        return forward(self._weights, state, self._sparse_input)
+
+
+    def predict_batch(self, states):
+        """
+        Predict the action values from a batch of states
+        """
+        return forward(self._weights, np.asarray(states), self._sparse_input)
 
 
     @property
     def input_dim(self):
-        return self._input_dim
\ No newline at end of file
+        return self._input_dim
+
+
+    @property
+    def q_cache(self):
+        return self._q_cache
+
+
+    @property
+    def weights(self):
+        return self._weights
+
+
+class DistilledModel:
+    def __init__(self, input_dim, model_path):
+        self._input_dim = input_dim
+        self._load_policy(os.path.join(model_path, 'distilled_policy.json'))
+
+
+    def _load_policy(self, policy_file_path):
+        """
+        Load the student policy written by distillation.py: a decision tree over the cells of the state, and a lookup
+        table of the decisions of the network on the packed states seen during the distillation
+        """
+        if not os.path.isfile(policy_file_path):
+            sys.exit("Distilled policy not found, run distillation.py first")
+        with open(policy_file_path) as file:
+            policy = json.load(file)
+        self._num_actions = policy['num_actions']
+        self._feature = policy['tree']['feature']
+        self._left = policy['tree']['left']
+        self._right = policy['tree']['right']
+        self._action = policy['tree']['action']
+        self._table = {bytes.fromhex(key): action for key, action in policy['table'].items()}
+
+
+    def choose(self, state):
+        """
+        Return the action of a single state: from the table if the state was seen, else from the tree
+        """
+        state = np.reshape(state, -1)
+        action = self._table.get(np.packbits(state != 0).tobytes())
+        if action is not None:
+            return action
+        node = 0
+        while self._feature[node] >= 0:
+            node = self._right[node] if state[self._feature[node]] else self._left[node]
+        return self._action[node]
+
+
+    def predict_one(self, state):
+        """
+        One-hot action values of the chosen action: the simulation only takes their argmax
+        """
+        q_values = np.zeros((1, self._num_actions))
+        q_values[0, self.choose(state)] = 1
+        return q_values
+
+
+    def predict_batch(self, states):
+        """
+        One-hot action values of a batch of states
+        """
+        states = np.asarray(states)
+        q_values = np.zeros((len(states), self._num_actions))
+        q_values[np.arange(len(states)), [self.choose(state) for state in states]] = 1
+        return q_values
+
+
+    @property
+    def input_dim(self):
+        return self._input_dim
+
+
+    @property
+    def q_cache(self):
+        return None
+
+
+class QValueCache:
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._cache = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+
+    def get(self, state, predict):
+        """
+        Return the action values of a binary occupancy state, calling predict only if the state is not in the cache.
+        The key is the state packed into bits (10 bytes for 80 cells), the least recently used state is dropped when the cache is full
+        """
+        key = np.packbits(np.asarray(state) != 0).tobytes()
+        q_values = self._cache.get(key)
+        if q_values is not None:
+            self._cache.move_to_end(key)
+            self._hits += 1
+            return q_values
+
+        self._misses += 1
+        q_values = predict()
+        self._cache[key] = q_values
+        if len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+        return q_values
+
+
+    def clear(self):
+        """
+        Drop every cached value, e.g. when the weights change; the counters are kept
+        """
+        self._cache.clear()
+
+
+    @property
+    def hits(self):
+        return self._hits
+
+
+    @property
+    def misses(self):
+        return self._misses
+
+
+    @property
+    def hit_rate(self):
+        lookups = self._hits + self._misses
+        return self._hits / lookups if lookups else 0.0
+
+
+def extract_weights(model):
+    """
+    Return the (kernel, bias) pairs of the dense layers of a keras model, from input to output.
+    A dueling head is folded into the dense layer with the same outputs
+    """
+    return [layer.dense_equivalent() if hasattr(layer, 'dense_equivalent') else tuple(layer.get_weights())
+            for layer in model.layers if layer.get_weights()]
+
+
+def save_weights(file_path, weights):
+    """
+    Save a list of (kernel, bias) pairs as npz file
+    """
+    arrays = {}
+    for i, (kernel, bias) in enumerate(weights):
+        arrays['kernel_%i' % i] = kernel
+        arrays['bias_%i' % i] = bias
+    np.savez(file_path, **arrays)
+
+
+def load_weights(file_path):
+    """
+    Load a list of (kernel, bias) pairs from a npz file written by save_weights
+    """
+    with np.load(file_path) as arrays:
+        n_layers = len(arrays.files) // 2
+        return [(arrays['kernel_%i' % i], arrays['bias_%i' % i]) for i in range(n_layers)]
+
+
+def forward(weights, states, sparse_input=False):
+    """
+    Numpy forward pass of the fully connected network: relu on the hidden layers, linear output.
+    With sparse input, the first layer is computed with embedding_bag, for binary states
+    """
+    x = states.astype(np.float32)
+    if sparse_input:
+        kernel, bias = weights[0]
+        x = np.maximum(embedding_bag(kernel, bias, x), 0)
+        weights = weights[1:]
+    for kernel, bias in weights[:-1]:
+        x = np.maximum(x @ kernel + bias, 0)
+    kernel, bias = weights[-1]
+    return x @ kernel + bias
+
+
+def embedding_bag(kernel, bias, states):
+    """
+    First layer of binary states without the matmul: gather the kernel rows of the occupied cells and sum them per state.
+    Same result as states @ kernel + bias
+    """
+    if len(states) == 1:  # predict_one: a single gather and sum
+        return (kernel[np.flatnonzero(states[0])].sum(axis=0) + bias)[None]
+    rows, cells = np.nonzero(states)  # row-major: the occupied cells of every state are contiguous
+    output = np.tile(bias, (len(states), 1))
+    if len(rows) > 0:
+        occupied_states, starts = np.unique(rows, return_index=True)
+        output[occupied_states] += np.add.reduceat(kernel[cells], starts, axis=0)
+    return output
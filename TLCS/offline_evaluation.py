@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import re
+import sys
+import argparse
+import timeit
+import numpy as np
+
+from testing_simulation import Simulation
+from generator import TrafficGenerator
+from sumo_session import SumoSession
+from model import TestModel
+from utils import import_test_configuration, set_sumo
+
+CORPUS_FILE = os.path.join('offline_evaluation', 'state_corpus.npz')
+REPORT_FILE = os.path.join('offline_evaluation', 'report.txt')
+
+
+def record_corpus(config, Model, episodes, every, corpus_file):
+    """
+    Run the model on the test demand for the given number of episodes (seeds episode_seed, episode_seed + 1, ...) and save
+    the state seen every `every` steps. The corpus keeps every distinct state once with its number of occurrences
+    """
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'], config['route_file_name'])
+    TrafficGen = TrafficGenerator(config['max_steps'], config['n_cars_generated'], route_file=os.path.join('intersection', config['route_file_name']))
+    states = []
+    for episode in range(episodes):
+        print('\n----- Recording episode', episode + 1, 'of', episodes)
+        Sim = Simulation(Model, TrafficGen, SumoSession(sumo_cmd, persistent=False), config['max_steps'], config['green_duration'],
+                         config['yellow_duration'], config['num_states'], config['num_actions'], record_every=every)
+        Sim.run(config['episode_seed'] + episode)
+        states += Sim.recorded_states
+
+    unique_states, counts = np.unique(np.array(states, dtype=np.uint8), axis=0, return_counts=True)
+    os.makedirs(os.path.dirname(corpus_file), exist_ok=True)
+    np.savez_compressed(corpus_file, states=unique_states, counts=counts)
+    print('Recorded %i states (%i distinct) in %s' % (len(states), len(unique_states), corpus_file))
+
+
+def saved_models(models_path_name):
+    """
+    Return the numbers of the models of the models folder, in increasing order
+    """
+    names = [name for name in os.listdir(models_path_name) if re.fullmatch(r'model_\d+', name)]
+    return sorted(int(name.split('_')[1]) for name in names)
+
+
+def score_models(model_numbers, models_path_name, states, counts, reference, num_actions):
+    """
+    Score every model on the whole corpus in one batched forward pass each: action distribution, disagreement with the
+    reference model and value estimate (max Q), all weighted by the occurrences of the states
+    """
+    weights = counts / counts.sum()
+    actions = {}
+    scores = []
+    for model_n in model_numbers:
+        Model = TestModel(input_dim=states.shape[1], model_path=os.path.join(models_path_name, 'model_%i' % model_n, ''))
+        q_values = Model.predict_batch(states)
+        actions[model_n] = np.argmax(q_values, axis=1)
+        values = q_values.max(axis=1)
+        mean_value = np.sum(weights * values)
+        scores.append({
+            'model': model_n,
+            'distribution': np.bincount(actions[model_n], weights=weights, minlength=num_actions),
+            'value': mean_value,
+            'value_std': np.sqrt(np.sum(weights * (values - mean_value) ** 2)),
+        })
+    for stats in scores:
+        stats['disagreement'] = np.sum(weights * (actions[stats['model']] != actions[reference])) if reference in actions else np.nan
+    return scores
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Rank the saved models on a recorded corpus of states, without simulating them")
+    parser.add_argument('--record', action='store_true', help="record the state corpus first (default: reuse the saved one)")
+    parser.add_argument('--episodes', type=int, default=3, help="episodes recorded, with consecutive seeds from episode_seed")
+    parser.add_argument('--every', type=int, default=5, help="steps between two recorded states")
+    parser.add_argument('--reference', type=int, default=None, help="reference model: drives the recording and is compared to (default: model_to_test)")
+    parser.add_argument('--models', type=int, nargs='+', default=None, help="models to score (default: all the models of the models folder)")
+    parser.add_argument('--corpus', default=CORPUS_FILE)
+    args = parser.parse_args()
+
+    config = import_test_configuration(config_file='testing_settings.ini')
+    reference = args.reference if args.reference is not None else config['model_to_test']
+
+    if args.record or not os.path.isfile(args.corpus):
+        Model = TestModel(input_dim=config['num_states'], model_path=os.path.join(config['models_path_name'], 'model_%i' % reference, ''))
+        record_corpus(config, Model, args.episodes, args.every, args.corpus)
+
+    with np.load(args.corpus) as corpus:
+        states, counts = corpus['states'].astype(np.float32), corpus['counts']
+    model_numbers = args.models if args.models is not None else saved_models(config['models_path_name'])
+    if not model_numbers:
+        sys.exit("No model to score in " + config['models_path_name'])
+
+    start_time = timeit.default_timer()
+    scores = score_models(model_numbers, config['models_path_name'], states, counts, reference, config['num_actions'])
+    scoring_time = timeit.default_timer() - start_time
+
+    lines = ['%i models scored on %i states (%i distinct) in %.2f s, disagreement against model_%i' % (
+        len(scores), counts.sum(), len(states), scoring_time, reference)]
+    lines.append("%-10s %13s %10s %10s   %s" % ('model', 'disagreement', 'mean V', 'std V', 'action distribution'))
+    for stats in scores:
+        distribution = " ".join("%5.1f%%" % (100 * share) for share in stats['distribution'])
+        lines.append("%-10s %12.1f%% %10.3f %10.3f   %s" % (
+            'model_%i' % stats['model'], 100 * stats['disagreement'], stats['value'], stats['value_std'], distribution))
+    report = "\n".join(lines)
+    print('\n' + report)
+
+    os.makedirs(os.path.dirname(REPORT_FILE), exist_ok=True)
+    with open(REPORT_FILE, "w") as file:
+        file.write(report + "\n")
+    print("----- Offline evaluation saved at:", REPORT_FILE)
@@ -0,0 +1,140 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import datetime
+
+REGISTRY_FILE = 'run_registry.sqlite'
+
+# config entries that don't change what is trained, left out of the config hash
+CONFIG_HASH_EXCLUDED = ('gui', 'models_path_name', 'route_file_name', 'plot_mode', 'plot_max_points', 'metrics_port', 'metrics_log',
+                        'persistent_sumo', 'snapshot_cache_size', 'q_cache_size', 'state_encoder')
+
+METRICS = ('final_reward', 'final_delay', 'final_queue', 'training_time')
+
+
+def config_hash(config):
+    """
+    Return a short hash identifying the training parameters of a config, regardless of paths and display options
+    """
+    relevant = {key: value for key, value in config.items() if key not in CONFIG_HASH_EXCLUDED}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class RunRegistry:
+    def __init__(self, registry_file=REGISTRY_FILE):
+        self._registry_file = registry_file
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")  # readers don't block the trainings that are writing
+            connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT UNIQUE,
+                config_hash TEXT,
+                config TEXT,
+                status TEXT,
+                started TEXT,
+                ended TEXT,
+                episodes INTEGER,
+                final_reward REAL,
+                final_delay REAL,
+                final_queue REAL,
+                training_time REAL)""")
+            if 'training_time' not in [column[1] for column in connection.execute("PRAGMA table_info(runs)")]:
+                connection.execute("ALTER TABLE runs ADD COLUMN training_time REAL")  # registry created before this metric
+            connection.execute("CREATE INDEX IF NOT EXISTS runs_config_hash ON runs (config_hash, final_queue)")
+            # runs registered before a change of CONFIG_HASH_EXCLUDED: hashed again, so they still match the same configs
+            for run_id, old_hash, config in connection.execute("SELECT run_id, config_hash, config FROM runs").fetchall():
+                new_hash = config_hash(json.loads(config))
+                if new_hash != old_hash:
+                    connection.execute("UPDATE runs SET config_hash = ? WHERE run_id = ?", (new_hash, run_id))
+
+
+    def _connect(self):
+        """
+        Open a connection that waits, instead of failing, while another process is writing
+        """
+        return sqlite3.connect(self._registry_file, timeout=60)
+
+
+    def register_run(self, path, config):
+        """
+        Add a new running training to the registry and return its id
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (path, config_hash, config, status, started) VALUES (?, ?, ?, 'running', ?)",
+                (path, config_hash(config), json.dumps(config, sort_keys=True), datetime.datetime.now().isoformat(timespec='seconds')))
+            return cursor.lastrowid
+
+
+    def update_run(self, run_id, status, episodes=None, **metrics):
+        """
+        Record the status of a run and, when available, its final metrics
+        """
+        for name in metrics:
+            if name not in METRICS:
+                sys.exit("Unknown metric '%s', choose from: %s" % (name, ", ".join(METRICS)))
+        columns = ['status = ?', 'ended = ?', 'episodes = COALESCE(?, episodes)'] + ['%s = ?' % name for name in metrics]
+        values = [status, datetime.datetime.now().isoformat(timespec='seconds'), episodes] + list(metrics.values())
+        with self._connect() as connection:
+            connection.execute("UPDATE runs SET " + ", ".join(columns) + " WHERE run_id = ?", values + [run_id])
+
+
+    def best_run(self, hash_value, metric='final_queue'):
+        """
+        Return the completed run with the lowest value of the metric among the runs of a config hash, or None
+        """
+        if metric not in METRICS:
+            sys.exit("Unknown metric '%s', choose from: %s" % (metric, ", ".join(METRICS)))
+        order = 'DESC' if metric == 'final_reward' else 'ASC'  # the reward is negative: the higher the better
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute(
+                "SELECT * FROM runs WHERE config_hash = ? AND status = 'completed' AND %s IS NOT NULL ORDER BY %s %s LIMIT 1" % (metric, metric, order),
+                (hash_value,)).fetchone()
+        return dict(row) if row is not None else None
+
+
+    def list_runs(self, hash_value=None):
+        """
+        Return every run, or only the runs of a config hash, from the oldest
+        """
+        query = "SELECT * FROM runs"
+        values = ()
+        if hash_value is not None:
+            query += " WHERE config_hash = ?"
+            values = (hash_value,)
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            return [dict(row) for row in connection.execute(query + " ORDER BY run_id", values)]
+
+
+def print_runs(runs):
+    """
+    Print runs in a formatted table
+    """
+    print("%-6s %-10s %-16s %8s %12s %10s %14s  %s" % ('id', 'status', 'config_hash', 'episodes', 'final_reward', 'final_queue', 'training_time', 'path'))
+    for run in runs:
+        print("%-6s %-10s %-16s %8s %12s %10s %14s  %s" % (run['run_id'], run['status'], run['config_hash'], run['episodes'],
+                                                         run['final_reward'], run['final_queue'], run['training_time'], os.path.relpath(run['path'])))
+
+
+if __name__ == "__main__":
+    from utils import import_train_configuration
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('list', 'best'):
+        sys.exit("usage: python registry.py list [config_file] | best config_file")
+
+    registry = RunRegistry()
+    hash_value = config_hash(import_train_configuration(sys.argv[2])) if len(sys.argv) > 2 else None
+    if sys.argv[1] == 'list':
+        print_runs(registry.list_runs(hash_value))
+    else:
+        best = registry.best_run(hash_value)
+        if best is None:
+            sys.exit("No completed run for this config")
+        print_runs([best])
@@ -0,0 +1,62 @@
+import math
+
+
+class ReplayScheduler:
+    def __init__(self, batch_size, max_batches, replay_ratio, max_passes, plateau_tolerance, chunk_batches, patience=3, smoothing=0.7):
+        self._batch_size = batch_size
+        self._max_batches = max_batches  # training_epochs: the fixed budget is the upper limit
+        self._replay_ratio = replay_ratio  # samples trained per new transition of the episode
+        self._max_passes = max_passes  # samples trained per sample in the memory
+        self._plateau_tolerance = plateau_tolerance
+        self._chunk_batches = chunk_batches
+        self._patience = patience  # chunks in a row without improvement before stopping
+        self._smoothing = smoothing  # weight of the past in the moving average of the chunk losses
+        self._smoothed_loss = None
+        self._best_loss = None
+        self._stale_chunks = 0
+
+
+    def plan(self, new_samples, memory_size):
+        """
+        Return the number of batches of the episode: replay_ratio samples trained per new transition, without training
+        more than max_passes times the memory (a small memory would be overfitted) nor more than the fixed budget
+        """
+        if memory_size == 0:
+            return 0
+        n_batches = math.ceil(self._replay_ratio * new_samples / self._batch_size)
+        n_batches = min(n_batches, math.ceil(self._max_passes * memory_size / self._batch_size), self._max_batches)
+        return max(n_batches, 1)
+
+
+    def chunks(self, n_batches):
+        """
+        Split the batches of the episode in chunks, the loss being checked for a plateau after each of them
+        """
+        return [min(self._chunk_batches, n_batches - start) for start in range(0, n_batches, self._chunk_batches)]
+
+
+    def start_episode(self):
+        """
+        Forget the losses of the previous episode: the targets have moved with the new samples and weights
+        """
+        self._smoothed_loss = None
+        self._best_loss = None
+        self._stale_chunks = 0
+
+
+    def plateau(self, loss):
+        """
+        Add the mean loss of the last chunk and return True once the smoothed loss (exponential moving average of the
+        chunk losses, the loss of a chunk of random batches with moving targets being noisy) has not improved by
+        plateau_tolerance (relative) on its best value for patience chunks in a row
+        """
+        if self._smoothed_loss is None:
+            self._smoothed_loss = loss
+        else:
+            self._smoothed_loss = self._smoothing * self._smoothed_loss + (1 - self._smoothing) * loss
+        if self._best_loss is None or self._smoothed_loss < self._best_loss * (1 - self._plateau_tolerance):
+            self._best_loss = self._smoothed_loss
+            self._stale_chunks = 0
+            return False
+        self._stale_chunks += 1
+        return self._stale_chunks >= self._patience
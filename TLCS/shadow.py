@@ -0,0 +1,92 @@
+import timeit
+import numpy as np
+
+from model import forward
+
+
+def stack_weights(weight_sets):
+    """
+    Stack the (kernel, bias) pairs of several networks layer by layer, as (policies x in x out, policies x out) arrays.
+    Return None if the networks do not all have the same architecture
+    """
+    shapes = [[kernel.shape for kernel, _ in weights] for weights in weight_sets]
+    if any(shape != shapes[0] for shape in shapes[1:]):
+        return None
+    return [(np.stack([weights[i][0] for weights in weight_sets]).astype(np.float32),
+             np.stack([weights[i][1] for weights in weight_sets]).astype(np.float32)) for i in range(len(shapes[0]))]
+
+
+def forward_stacked(stacked, state):
+    """
+    Forward pass of all the stacked networks on the same state in one batched matmul per layer: relu on the hidden
+    layers, linear output. Return the action values as a policies x actions array
+    """
+    n_policies = stacked[0][0].shape[0]
+    x = np.broadcast_to(np.asarray(state, dtype=np.float32).reshape(1, 1, -1), (n_policies, 1, stacked[0][0].shape[1]))
+    for kernel, bias in stacked[:-1]:
+        x = np.maximum(np.matmul(x, kernel) + bias[:, None], 0)
+    kernel, bias = stacked[-1]
+    return (np.matmul(x, kernel) + bias[:, None])[:, 0]
+
+
+class ShadowPolicies:
+    def __init__(self, names, weight_sets, num_actions):
+        self._names = names
+        self._weight_sets = weight_sets
+        self._stacked = stack_weights(weight_sets)  # None: one forward pass per network
+        self._decisions = 0
+        self._agreements = np.zeros(len(names))
+        self._action_counts = np.zeros((len(names), num_actions), dtype=int)
+        self._q_abs_diff = np.zeros(len(names))  # sum over the decisions of the mean |Q shadow - Q actuator| over the actions
+        self._value_diff = np.zeros(len(names))  # sum over the decisions of max Q shadow - max Q actuator
+        self._time = 0
+
+
+    def predict(self, state):
+        """
+        Action values of every shadow policy on the same state, as a policies x actions array
+        """
+        if self._stacked is not None:
+            return forward_stacked(self._stacked, state)
+        return np.concatenate([forward(weights, np.reshape(state, (1, -1))) for weights in self._weight_sets])
+
+
+    def record(self, state, q_values, action):
+        """
+        Compute the decisions of the shadow policies on the state the actuating policy decided on, and accumulate their
+        agreement with its action and the difference of their action values with its own ones
+        """
+        start_time = timeit.default_timer()
+        q_values = np.reshape(q_values, -1)
+        shadow_q = self.predict(state)
+        shadow_actions = np.argmax(shadow_q, axis=1)
+
+        self._decisions += 1
+        self._agreements += shadow_actions == action
+        self._action_counts[np.arange(len(self._names)), shadow_actions] += 1
+        self._q_abs_diff += np.abs(shadow_q - q_values).mean(axis=1)
+        self._value_diff += shadow_q.max(axis=1) - q_values.max()
+        self._time += timeit.default_timer() - start_time
+
+
+    def report(self):
+        """
+        Return the comparison of every shadow policy with the actuating one, as text lines
+        """
+        decisions = max(self._decisions, 1)
+        lines = ["%-12s %10s %12s %12s   %s" % ('policy', 'agreement', 'mean |dQ|', 'mean dV', 'action distribution')]
+        for i, name in enumerate(self._names):
+            distribution = " ".join("%5.1f%%" % (100 * count / decisions) for count in self._action_counts[i])
+            lines.append("%-12s %9.1f%% %12.3f %12.3f   %s" % (
+                name, 100 * self._agreements[i] / decisions, self._q_abs_diff[i] / decisions, self._value_diff[i] / decisions, distribution))
+        return lines
+
+
+    @property
+    def decisions(self):
+        return self._decisions
+
+
+    @property
+    def time(self):
+        return self._time
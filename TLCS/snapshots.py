@@ -0,0 +1,63 @@
+import os
+import glob
+import hashlib
+import traci
+
+
+class SnapshotCache:
+    def __init__(self, cache_path, max_snapshots):
+        self._cache_path = cache_path
+        self._max_snapshots = max_snapshots
+        self._hits = 0
+        self._misses = 0
+
+
+    def warm_start(self, route_file, step):
+        """
+        Bring the simulation just loaded in SUMO to the given step, without the agent: load the saved state if there is one
+        for this route file (so for this seed and demand), otherwise simulate up to the step and save the state for the next time
+        """
+        snapshot_file = self._snapshot_file(route_file, step)
+        if os.path.isfile(snapshot_file):
+            traci.simulation.loadState(snapshot_file)
+            os.utime(snapshot_file)  # mark as recently used
+            self._hits += 1
+        else:
+            traci.simulationStep(step)  # a single call, sumo runs up to the step on its own
+            os.makedirs(self._cache_path, exist_ok=True)
+            temporary_file = os.path.join(self._cache_path, 'tmp_%i_%s' % (os.getpid(), os.path.basename(snapshot_file)))
+            traci.simulation.saveState(temporary_file)
+            os.replace(temporary_file, snapshot_file)  # atomic: runs sharing the cache never read a partial state
+            self._misses += 1
+            self._evict()
+
+
+    def _snapshot_file(self, route_file, step):
+        """
+        Name of the snapshot of a route file at a step: the content hash identifies seed, demand and episode length
+        """
+        with open(route_file, 'rb') as file:
+            route_hash = hashlib.sha1(file.read()).hexdigest()[:16]
+        return os.path.join(self._cache_path, 'state_%s_%i.xml.gz' % (route_hash, step))
+
+
+    def _evict(self):
+        """
+        Delete the least recently used snapshots beyond the maximum number allowed
+        """
+        snapshot_files = sorted(glob.glob(os.path.join(self._cache_path, 'state_*.xml.gz')), key=os.path.getmtime)
+        for snapshot_file in snapshot_files[:max(len(snapshot_files) - self._max_snapshots, 0)]:
+            try:
+                os.remove(snapshot_file)
+            except OSError:
+                pass  # already removed by another run sharing the cache
+
+
+    @property
+    def hits(self):
+        return self._hits
+
+
+    @property
+    def misses(self):
+        return self._misses
@@ -0,0 +1,31 @@
+import tensorflow as tf
+from tensorflow import keras
+
+# keras layer kept in its own module: model.py imports it only when a sparse-input network is built or loaded,
+# so importing model.py still does not pull in tensorflow
+
+
+class OccupancyEmbeddingBag(keras.layers.Layer):
+    """
+    First layer for binary occupancy states: the output of every state is the sum of the kernel rows of its occupied
+    cells plus the bias, then relu (embedding bag). Same weights and same outputs as Dense(units, activation='relu')
+    """
+    def __init__(self, units, **kwargs):
+        super().__init__(**kwargs)
+        self.units = units
+
+
+    def build(self, input_shape):
+        self.kernel = self.add_weight(name='kernel', shape=(int(input_shape[-1]), self.units), initializer='glorot_uniform')
+        self.bias = self.add_weight(name='bias', shape=(self.units,), initializer='zeros')
+
+
+    def call(self, inputs):
+        occupied = tf.sparse.from_dense(inputs)  # only the occupied cells, the matmul gathers and sums their kernel rows
+        return tf.nn.relu(tf.sparse.sparse_dense_matmul(occupied, self.kernel) + self.bias)
+
+
+    def get_config(self):
+        config = super().get_config()
+        config['units'] = self.units
+        return config
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import argparse
+import timeit
+import tracemalloc
+import numpy as np
+
+from testing_simulation import Simulation
+from demand import DemandGenerator, peak_profile
+from sumo_session import SumoSession
+from model import TestModel, forward
+from utils import import_test_configuration, set_sumo
+
+
+class RandomModel:
+    """
+    Network with random weights and the architecture of the trained ones: same decision latency as a trained model,
+    for the stress tests run before any model exists
+    """
+    def __init__(self, input_dim, output_dim, num_layers, width, seed=0):
+        rng = np.random.default_rng(seed)
+        sizes = [input_dim] + [width] * num_layers + [output_dim]
+        self._weights = [(rng.normal(0, np.sqrt(2 / n_in), (n_in, n_out)).astype(np.float32), np.zeros(n_out, dtype=np.float32))
+                         for n_in, n_out in zip(sizes[:-1], sizes[1:])]
+
+
+    def predict_one(self, state):
+        return forward(self._weights, np.reshape(state, (1, -1)))
+
+
+    def predict_batch(self, states):
+        return forward(self._weights, np.asarray(states))
+
+
+def stress_rates(n_vehicles, hours, slots_per_hour=4):
+    """
+    Rate profile of a stress scenario: n_vehicles over the given hours, with a peak in the middle twice as high as the base rate
+    """
+    n_slots = hours * slots_per_hour
+    rates = peak_profile(n_slots, 1.0, [(n_slots / 2, n_slots / 4, 2.0)])
+    return rates * n_vehicles / (rates.sum() / slots_per_hour)  # expected number of vehicles = n_vehicles
+
+
+def run_scenario(config, Model, n_vehicles, hours, steps, seed):
+    """
+    Generate one stress scenario and run the agent on its first steps, returning generation and decision latency stats.
+    The generation is measured on its own, the simulation generates the same route file again from the same seed
+    """
+    route_file_name = 'stress_routes_%i.rou.xml' % n_vehicles
+    slots_per_hour = 4
+    DemandGen = DemandGenerator(
+        hours * 3600,
+        stress_rates(n_vehicles, hours, slots_per_hour),
+        slot_seconds=3600 // slots_per_hour,
+        route_file=os.path.join('intersection', route_file_name)
+    )
+
+    tracemalloc.start()
+    start_time = timeit.default_timer()
+    n_generated = DemandGen.generate_routefile(seed)
+    generation_time = timeit.default_timer() - start_time
+    generation_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], steps, route_file_name)
+    Sumo = SumoSession(sumo_cmd, persistent=False)
+    Sim = Simulation(Model, DemandGen, Sumo, steps, config['green_duration'], config['yellow_duration'], config['num_states'], config['num_actions'])
+    simulation_time = Sim.run(seed)
+
+    latencies = np.array(Sim.decision_times) * 1000
+    return {
+        'vehicles': n_generated,
+        'generation_time': generation_time,
+        'generation_memory': generation_memory / 1e6,
+        'file_size': os.path.getsize(DemandGen.route_file) / 1e6,
+        'decisions': len(latencies),
+        'avg_in_network': np.mean(Sim.decision_vehicles),
+        'max_in_network': np.max(Sim.decision_vehicles),
+        'avg_latency': np.mean(latencies),
+        'p95_latency': np.percentile(latencies, 95),
+        'simulation_time': simulation_time,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Scaling report of the decision latency of the agent against the demand")
+    parser.add_argument('--vehicles', type=int, nargs='+', default=[10000, 30000, 100000], help="vehicles of every stress scenario")
+    parser.add_argument('--hours', type=int, default=1, help="duration of the demand of every scenario")
+    parser.add_argument('--steps', type=int, default=1800, help="steps simulated with the agent in every scenario")
+    parser.add_argument('--model', type=int, default=None, help="model to test (default: random weights with the architecture below)")
+    parser.add_argument('--num-layers', type=int, default=5)
+    parser.add_argument('--width', type=int, default=400)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = import_test_configuration(config_file='testing_settings.ini')
+    if args.model is not None:
+        Model = TestModel(input_dim=config['num_states'], model_path=os.path.join(config['models_path_name'], 'model_%i' % args.model, ''))
+    else:
+        Model = RandomModel(config['num_states'], config['num_actions'], args.num_layers, args.width)
+
+    results = []
+    for n_vehicles in args.vehicles:
+        print('\n----- Stress scenario:', n_vehicles, 'vehicles in', args.hours, 'h')
+        results.append(run_scenario(config, Model, n_vehicles, args.hours, args.steps, args.seed))
+
+    header = "%9s %9s %9s %9s %10s %10s %10s %12s %12s %9s" % ('vehicles', 'gen (s)', 'gen (MB)', 'file (MB)', 'decisions', 'avg in net',
+                                                             'max in net', 'avg lat (ms)', 'p95 lat (ms)', 'sim (s)')
+    lines = [header]
+    for stats in results:
+        lines.append("%9i %9.2f %9.1f %9.1f %10i %10.1f %10i %12.2f %12.2f %9.1f" % (
+            stats['vehicles'], stats['generation_time'], stats['generation_memory'], stats['file_size'], stats['decisions'],
+            stats['avg_in_network'], stats['max_in_network'], stats['avg_latency'], stats['p95_latency'], stats['simulation_time']))
+    report = "\n".join(lines)
+    print('\n' + report)
+
+    os.makedirs('stress_test', exist_ok=True)
+    with open(os.path.join('stress_test', 'scaling_report.txt'), "w") as file:
+        file.write(report + "\n")
+    print("----- Scaling report saved at:", os.path.join('stress_test', 'scaling_report.txt'))
@@ -0,0 +1,74 @@
+import os
+import xml.etree.ElementTree as ET
+
+from metrics import RunningStats
+
+INCOMING_ROADS = ["DR2", "RU1", "UL2", "LD1"]
+
+
+def write_edgedata_additional(additional_file, edgedata_file):
+    """
+    Write a SUMO additional file asking for edge data of the incoming roads every step: the waitingTime of an edge over a 1 s
+    interval is the number of halting vehicles in that step, the same queue measure as traci.edge.getLastStepHaltingNumber
+    """
+    with open(additional_file, "w") as file:
+        print('<additional>', file=file)
+        print('    <edgeData id="incoming" file="%s" period="1" edges="%s"/>' % (os.path.abspath(edgedata_file), " ".join(INCOMING_ROADS)), file=file)
+        print('</additional>', file=file)
+
+
+def iter_elements(xml_file, tag):
+    """
+    Stream the elements with the given tag from a SUMO output file. Every element is cleared from the tree once the caller
+    is done with it, so the memory used does not depend on the size of the file
+    """
+    context = ET.iterparse(xml_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event == 'end' and element.tag == tag:
+            yield element
+            root.clear()  # drop the processed element, and everything before it
+
+
+def ingest_edgedata(edgedata_file, queue_data_file):
+    """
+    Stream the per-step edge data, writing the queue length of every step to queue_data_file (one value per line, like
+    Visualization.save_data_and_plot) and return the queue stats
+    """
+    queue = RunningStats()
+    with open(queue_data_file, "w") as file:
+        for interval in iter_elements(edgedata_file, 'interval'):
+            queue_length = int(round(sum(float(edge.get('waitingTime', 0)) for edge in interval.iter('edge'))))
+            queue.add(queue_length)
+            file.write("%s\n" % queue_length)
+    return {'steps': queue.count, 'avg_queue': queue.mean, 'max_queue': queue.max, 'total_queue': queue.total}
+
+
+def ingest_tripinfo(tripinfo_file):
+    """
+    Stream the trip info of every arrived vehicle and return the average and maximum waiting time, time loss and duration
+    """
+    waiting, time_loss, duration = RunningStats(), RunningStats(), RunningStats()
+    for trip in iter_elements(tripinfo_file, 'tripinfo'):
+        waiting.add(float(trip.get('waitingTime')))
+        time_loss.add(float(trip.get('timeLoss')))
+        duration.add(float(trip.get('duration')))
+    return {
+        'arrived': waiting.count,
+        'avg_waiting_time': waiting.mean,
+        'max_waiting_time': waiting.max if waiting.count else 0.0,
+        'avg_time_loss': time_loss.mean,
+        'avg_duration': duration.mean,
+    }
+
+
+def ingest_summary(summary_file):
+    """
+    Stream the network summary and return what it says at the end of the run
+    """
+    last = None
+    for step in iter_elements(summary_file, 'step'):
+        last = dict(step.attrib)
+    if last is None:
+        return {}
+    return {'inserted': int(last['inserted']), 'running': int(last['running']), 'waiting_insertion': int(last['waiting'])}
@@ -0,0 +1,119 @@
+import timeit
+import traci
+
+# errors meaning that the SUMO process is gone or the connection is unusable
+SUMO_ERRORS = (traci.exceptions.FatalTraCIError, traci.exceptions.TraCIException, ConnectionError, OSError)
+
+
+class SumoSession:
+    def __init__(self, sumo_cmd, persistent=True, Snapshots=None, warm_start_step=0):
+        self._sumo_cmd = sumo_cmd
+        self._persistent = persistent
+        self._Snapshots = Snapshots
+        self._warm_start_step = warm_start_step
+        self._running = False
+        self._fresh_startup_time = None  # seconds needed by the last traci.start (process fork + network parsing)
+        self._last_startup_time = 0
+        self._restarts = 0
+
+
+    def start_episode(self):
+        """
+        Make SUMO ready for a new episode with the current route file and return the step where the episode starts.
+        The first episode starts the SUMO process, in persistent mode the next ones reload network and routes in the same
+        process with traci.load. A process that crashed or was closed is started again.
+        With a warm start, the episode starts from the state of the network at warm_start_step, loaded from the snapshot cache
+        """
+        start_time = timeit.default_timer()
+        if self._running and self._persistent:
+            try:
+                traci.load(self._sumo_cmd[1:])  # same options as the start command, without the binary
+            except SUMO_ERRORS:
+                print("SUMO process lost, restarting it")
+                self._restarts += 1
+                self._discard_connection()
+                self._start()
+        else:
+            self._start()
+        self._last_startup_time = timeit.default_timer() - start_time
+
+        if self._Snapshots is not None and self._warm_start_step > 0:
+            self._Snapshots.warm_start(self._sumo_cmd[self._sumo_cmd.index("-r") + 1], self._warm_start_step)
+            return self._warm_start_step
+        return 0
+
+
+    def fast_forward_idle(self, step, max_steps, next_departure):
+        """
+        When the network is empty, jump in a single simulationStep call to the step before the next departure, since nothing
+        can happen until then. Return the new step: max_steps if no car departs any more (the episode can end), or the same step
+        if there are vehicles in the network or waiting to be inserted
+        """
+        if traci.vehicle.getIDCount() > 0 or traci.simulation.getPendingVehicles():
+            return step
+        if next_departure is None:
+            return max_steps
+        target = int(next_departure) - 1
+        if target >= max_steps:
+            return max_steps
+        if target <= step:
+            return step
+        traci.simulationStep(target)
+        return target
+
+
+    def end_episode(self):
+        """
+        End the current episode: in persistent mode the SUMO process is kept for the next one
+        """
+        if not self._persistent:
+            self.close()
+
+
+    def close(self):
+        """
+        Close the connection and the SUMO process
+        """
+        if self._running:
+            try:
+                traci.close()
+            except SUMO_ERRORS:
+                self._discard_connection()
+            self._running = False
+
+
+    def _start(self):
+        """
+        Start a new SUMO process and measure how long it takes
+        """
+        start_time = timeit.default_timer()
+        label = 'default' if self._restarts == 0 else 'restart_%i' % self._restarts  # a broken connection may still hold the old label
+        traci.start(self._sumo_cmd, label=label)
+        self._running = True
+        self._fresh_startup_time = timeit.default_timer() - start_time
+
+
+    def _discard_connection(self):
+        """
+        Close what is left of a broken connection, the next traci.start uses a new label anyway
+        """
+        try:
+            traci.close(wait=False)
+        except SUMO_ERRORS:
+            pass
+        self._running = False
+
+
+    @property
+    def last_startup_time(self):
+        return self._last_startup_time
+
+
+    @property
+    def fresh_startup_time(self):
+        return self._fresh_startup_time
+
+
+    @property
+    def restarts(self):
+        return self._restarts
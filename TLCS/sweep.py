@@ -0,0 +1,229 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+import itertools
+import subprocess
+import configparser
+import numpy as np
+
+# parameters that can be swept, with the section of training_settings.ini where they live
+SWEEP_PARAMETERS = {
+    'num_layers': 'model',
+    'width_layers': 'model',
+    'batch_size': 'model',
+    'learning_rate': 'model',
+    'gamma': 'agent',
+    'green_duration': 'simulation',
+    'n_step': 'agent',
+    'dueling': 'model',
+    'replay_schedule': 'model',
+}
+
+
+def import_sweep_configuration(config_file):
+    """
+    Read the config file regarding the sweep and import its content
+    """
+    content = configparser.ConfigParser()
+    content.read(config_file)
+    config = {}
+    config['sweep_name'] = content['sweep']['sweep_name']
+    config['base_config'] = content['sweep']['base_config']
+    config['search'] = content['sweep']['search']
+    config['n_trials'] = content['sweep'].getint('n_trials')
+    config['seed'] = content['sweep'].getint('seed')
+    config['total_episodes'] = content['sweep'].getint('total_episodes')
+    config['max_parallel_trials'] = content['sweep'].getint('max_parallel_trials')
+    config['threads_per_trial'] = content['sweep'].getint('threads_per_trial')
+    config['early_stopping'] = content['early_stopping'].getboolean('enabled')
+    config['grace_episodes'] = content['early_stopping'].getint('grace_episodes')
+    config['window'] = content['early_stopping'].getint('window')
+    config['min_trials'] = content['early_stopping'].getint('min_trials')
+    config['space'] = {name: [value.strip() for value in values.split(',')] for name, values in content['space'].items()}
+    for name in config['space']:
+        if name not in SWEEP_PARAMETERS:
+            sys.exit("Parameter '%s' cannot be swept, choose from: %s" % (name, ", ".join(SWEEP_PARAMETERS)))
+    return config
+
+
+def expand_space(space, search, n_trials, seed):
+    """
+    Expand the parameter space into the list of trial parameters: every combination for a grid search,
+    n_trials combinations drawn uniformly from the grid for a random search
+    """
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+    if search == 'grid':
+        return grid
+    elif search == 'random':
+        rng = random.Random(seed)
+        return rng.sample(grid, min(n_trials, len(grid)))
+    else:
+        sys.exit("search must be 'grid' or 'random'")
+
+
+def write_trial_configuration(base_config, sweep_path, trial_id, params, total_episodes):
+    """
+    Write the training config of a trial: the base config with the trial parameters, its own models folder and route file
+    """
+    content = configparser.ConfigParser()
+    content.read(base_config)
+    for name, value in params.items():
+        content[SWEEP_PARAMETERS[name]][name] = value
+    content['simulation']['gui'] = 'False'
+    content['simulation']['total_episodes'] = str(total_episodes)
+    content['dir']['models_path_name'] = os.path.join(sweep_path, trial_id)
+    content['dir']['route_file_name'] = 'episode_routes_%s_%s.rou.xml' % (os.path.basename(sweep_path), trial_id)
+
+    config_file = os.path.join(sweep_path, trial_id + '.ini')
+    with open(config_file, "w") as file:
+        content.write(file)
+    return config_file
+
+
+def read_progress(trial_path):
+    """
+    Return the per-episode average queue length written so far by a trial (training_main.py progress.txt)
+    """
+    progress_file = os.path.join(trial_path, 'model_1', 'progress.txt')
+    if not os.path.isfile(progress_file):
+        return np.array([])
+    with open(progress_file, 'r') as file:
+        rows = [line.split('\t') for line in file.read().splitlines()[1:] if line]
+    return np.array([float(row[3]) for row in rows])
+
+
+class Trial:
+    def __init__(self, trial_id, params, config_file, trial_path):
+        self.trial_id = trial_id
+        self.params = params
+        self.config_file = config_file
+        self.trial_path = trial_path
+        self.status = 'pending'
+        self.queue = np.array([])
+        self._process = None
+        self._log = None
+
+
+    def start(self, threads):
+        """
+        Launch training_main.py on the trial config, with a limited number of cpu threads
+        """
+        env = dict(os.environ)
+        for variable in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+            env[variable] = str(threads)
+        self._log = open(os.path.join(os.path.dirname(self.trial_path), self.trial_id + '.log'), "w")
+        self._process = subprocess.Popen([sys.executable, 'training_main.py', self.config_file], stdout=self._log, stderr=subprocess.STDOUT, env=env)
+        self.status = 'running'
+
+
+    def poll(self):
+        """
+        Refresh the progress of a running trial and return True if it has ended
+        """
+        self.queue = read_progress(self.trial_path)
+        if self._process.poll() is None:
+            return False
+        self.status = 'completed' if self._process.returncode == 0 else 'failed'
+        self._log.close()
+        return True
+
+
+    def stop(self):
+        """
+        Terminate a poorly performing trial
+        """
+        self._process.terminate()
+        self._process.wait()
+        self._log.close()
+        self.queue = read_progress(self.trial_path)
+        self.status = 'stopped'
+
+
+    def score(self, window):
+        """
+        Average queue length over the last episodes available: the lower the better
+        """
+        if len(self.queue) == 0:
+            return float('inf')
+        return float(np.mean(self.queue[-window:]))
+
+
+def should_stop(trial, trials, config):
+    """
+    Median stopping rule: stop a trial when its average queue over the last episodes is worse than the median
+    of what the other trials achieved at the same episode
+    """
+    episode = len(trial.queue)
+    if episode < config['grace_episodes']:
+        return False
+    others = [other for other in trials if other is not trial and len(other.queue) >= episode]
+    if len(others) < config['min_trials']:
+        return False
+    others_at_episode = [np.mean(other.queue[max(episode - config['window'], 0):episode]) for other in others]
+    return trial.score(config['window']) > np.median(others_at_episode)
+
+
+def save_leaderboard(trials, sweep_path, window):
+    """
+    Save every trial, sorted by average queue length over its last episodes, in a tab separated leaderboard
+    """
+    names = sorted(SWEEP_PARAMETERS)
+    status_order = {'completed': 0, 'stopped': 1, 'failed': 2, 'running': 3, 'pending': 4}  # stopped trials have fewer episodes, not comparable
+    ranked = sorted(trials, key=lambda trial: (status_order[trial.status], trial.score(window)))
+    leaderboard_file = os.path.join(sweep_path, 'leaderboard.txt')
+    with open(leaderboard_file, "w") as file:
+        file.write("\t".join(['rank', 'trial', 'status', 'episodes', 'final_queue', 'best_queue'] + names) + "\n")
+        for rank, trial in enumerate(ranked, 1):
+            best = np.min(trial.queue) if len(trial.queue) > 0 else float('inf')
+            params = [trial.params.get(name, '-') for name in names]
+            file.write("\t".join([str(rank), trial.trial_id, trial.status, str(len(trial.queue)), "%.2f" % trial.score(window), "%.2f" % best] + params) + "\n")
+    return leaderboard_file
+
+
+def run_sweep(config):
+    """
+    Run every trial of the sweep, at most max_parallel_trials at the same time, stopping the poor ones early
+    """
+    sweep_path = os.path.join('sweeps', config['sweep_name'])
+    os.makedirs(sweep_path, exist_ok=True)
+
+    trials = []
+    for i, params in enumerate(expand_space(config['space'], config['search'], config['n_trials'], config['seed'])):
+        trial_id = 'trial_%i' % (i+1)
+        config_file = write_trial_configuration(config['base_config'], sweep_path, trial_id, params, config['total_episodes'])
+        trials.append(Trial(trial_id, params, config_file, os.path.join(sweep_path, trial_id)))
+    print("----- Sweep", config['sweep_name'], "-", len(trials), "trials,", config['max_parallel_trials'], "in parallel")
+
+    pending = list(trials)
+    running = []
+    while pending or running:
+        while pending and len(running) < config['max_parallel_trials']:
+            trial = pending.pop(0)
+            trial.start(config['threads_per_trial'])
+            running.append(trial)
+            print("Started", trial.trial_id, trial.params)
+
+        time.sleep(5)
+        for trial in list(running):
+            if trial.poll():
+                running.remove(trial)
+                print("Ended", trial.trial_id, "-", trial.status, "- queue: %.2f" % trial.score(config['window']))
+            elif config['early_stopping'] and should_stop(trial, trials, config):
+                trial.stop()
+                running.remove(trial)
+                print("Stopped early", trial.trial_id, "at episode", len(trial.queue), "- queue: %.2f" % trial.score(config['window']))
+
+    leaderboard_file = save_leaderboard(trials, sweep_path, config['window'])
+    print("----- Leaderboard saved at:", leaderboard_file)
+    with open(leaderboard_file, 'r') as file:
+        print(file.read())
+
+
+if __name__ == "__main__":
+    config = import_sweep_configuration(sys.argv[1] if len(sys.argv) > 1 else 'sweep_settings.ini')
+    run_sweep(config)
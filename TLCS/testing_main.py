@@ -2,54 +2,155 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import numpy as np
 from shutil import copyfile
 
 from testing_simulation import Simulation
 from generator import TrafficGenerator
-from model import TestModel
+from sumo_session import SumoSession
+from snapshots import SnapshotCache
+from detectors import DetectorStateEncoder, StopLineDetectors, DETECTORS_FILE, TRIGGER_DETECTORS_FILE
+from model import TestModel, DistilledModel
+from shadow import ShadowPolicies
+from metrics import StreamingSeries
 from visualization import Visualization
 from utils import import_test_configuration, set_sumo, set_test_path
 
 
+def build_model(config, model_path):
+    if config['backend'] == 'distilled':
+        return DistilledModel(input_dim=config['num_states'], model_path=model_path)
+    return TestModel(
+        input_dim=config['num_states'],
+        model_path=model_path,
+        q_cache_size=config['q_cache_size'],
+        sparse_input=config['sparse_input']
+    )
+
+
+def decision_stats(Sim):
+    """
+    Decisions and controller cpu time of a test run, per simulated hour
+    """
+    simulated_hours = len(Sim.queue_length_episode) / 3600
+    return len(Sim.decision_times), len(Sim.decision_times) / simulated_hours, Sim.cpu_time / simulated_hours
+
+
 if __name__ == "__main__":
 
     config = import_test_configuration(config_file='testing_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+    StateEncoder = None
+    if config['state_encoder'] == 'detectors':
+        StateEncoder = DetectorStateEncoder(config['num_states'], os.path.join('intersection', config['sumocfg_file_name']))
+    StopLines = None
+    if config['decision_mode'] == 'event' and config['detector_trigger']:
+        StopLines = StopLineDetectors(os.path.join('intersection', config['sumocfg_file_name']))
+    additional_files = ([DETECTORS_FILE] if StateEncoder is not None else []) + ([TRIGGER_DETECTORS_FILE] if StopLines is not None else [])
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], config['route_file_name'],
+                        additional_files=additional_files)
     model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'])
 
-    Model = TestModel(
-        input_dim=config['num_states'],
-        model_path=model_path
-    )
+    Model = build_model(config, model_path)
+
+    Shadow = None
+    if config['shadow_models']:
+        shadow_weights = [TestModel(input_dim=config['num_states'], model_path=os.path.join(config['models_path_name'], 'model_%i' % model_n, '')).weights
+                          for model_n in config['shadow_models']]
+        Shadow = ShadowPolicies(['model_%i' % model_n for model_n in config['shadow_models']], shadow_weights, config['num_actions'])
 
     TrafficGen = TrafficGenerator(
         config['max_steps'], 
-        config['n_cars_generated']
+        config['n_cars_generated'],
+        route_file=os.path.join('intersection', config['route_file_name'])
+    )
+
+    Snapshots = SnapshotCache(
+        os.path.join('intersection', 'snapshots'),
+        config['snapshot_cache_size']
+    )
+
+    Sumo = SumoSession(
+        sumo_cmd,
+        persistent=False,
+        Snapshots=Snapshots,
+        warm_start_step=config['warm_start_step']
     )
 
     Visualization = Visualization(
         plot_path, 
-        dpi=96
+        dpi=96,
+        plot_mode=config['plot_mode'],
+        max_points=config['plot_max_points']
     )
         
+    QueueSeries = None
+    if config['streaming_metrics']:
+        QueueSeries = StreamingSeries(
+            config['metrics_max_points'],
+            sink_file=os.path.join(plot_path, 'plot_queue_full_data.txt') if config['full_resolution'] else None
+        )
+
+    Baseline = None
+    if config['decision_mode'] == 'event':
+        # the fixed decision loop on the same episode, with its own model (and cache), to report both modes side by side
+        Baseline = Simulation(build_model(config, model_path), TrafficGen, Sumo, config['max_steps'], config['green_duration'], config['yellow_duration'],
+                              config['num_states'], config['num_actions'], idle_fast_forward=config['idle_fast_forward'], StateEncoder=StateEncoder)
+
     Simulation = Simulation(
         Model,
         TrafficGen,
-        sumo_cmd,
+        Sumo,
         config['max_steps'],
         config['green_duration'],
         config['yellow_duration'],
         config['num_states'],
-        config['num_actions']
+        config['num_actions'],
+        idle_fast_forward=config['idle_fast_forward'],
+        StateEncoder=StateEncoder,
+        decision_mode=config['decision_mode'],
+        min_green=config['min_green'],
+        max_green=config['max_green'],
+        queue_threshold=config['queue_threshold'],
+        Shadow=Shadow,
+        QueueSeries=QueueSeries,
+        StopLines=StopLines
     )
 
     print('\n----- Test episode')
     simulation_time = Simulation.run(config['episode_seed'])  # run the simulation
     print('Simulation time:', simulation_time, 's')
+    print('Decisions: %i (%.1f per simulated hour) - Controller CPU: %.2f s per simulated hour' % decision_stats(Simulation))
+    if Model.q_cache is not None:
+        print('Q-value cache: %i hits, %i misses (hit rate %.1f%%)' % (Model.q_cache.hits, Model.q_cache.misses, Model.q_cache.hit_rate * 100))
+
+    if Shadow is not None:
+        shadow_report = ['Shadow policies against model_%i, %i decisions (%.2f ms per decision):' % (
+            config['model_to_test'], Shadow.decisions, 1000 * Shadow.time / max(Shadow.decisions, 1))] + Shadow.report()
+        print("\n".join(shadow_report))
+        with open(os.path.join(plot_path, 'shadow_report.txt'), "w") as file:
+            file.write("\n".join(shadow_report) + "\n")
+
+    if Baseline is not None:
+        print('\n----- Same episode with fixed decisions')
+        Baseline.run(config['episode_seed'])
+        mean_queue = QueueSeries.stats.mean if QueueSeries is not None else np.mean(Simulation.queue_length_episode)
+        comparison = ['%-8s %10s %12s %14s %11s' % ('mode', 'decisions', 'decisions/h', 'cpu s/sim h', 'mean queue')]
+        for mode, Sim, queue in (('event', Simulation, mean_queue), ('fixed', Baseline, np.mean(Baseline.queue_length_episode))):
+            comparison.append('%-8s %10i %12.1f %14.2f %11.2f' % ((mode,) + decision_stats(Sim) + (queue,)))
+        print("\n".join(comparison))
+        with open(os.path.join(plot_path, 'decision_modes.txt'), "w") as file:
+            file.write("\n".join(comparison) + "\n")
 
     print("----- Testing info saved at:", plot_path)
 
     copyfile(src='testing_settings.ini', dst=os.path.join(plot_path, 'testing_settings.ini'))
 
     Visualization.save_data_and_plot(data=Simulation.reward_episode, filename='reward', xlabel='Action step', ylabel='Reward')
-    Visualization.save_data_and_plot(data=Simulation.queue_length_episode, filename='queue', xlabel='Step', ylabel='Queue lenght (vehicles)')
+    if QueueSeries is not None:
+        QueueSeries.close()
+        QueueSeries.save_summary(os.path.join(plot_path, 'plot_queue_stats.txt'))
+        Visualization.save_data_and_plot(data=QueueSeries.windows.means(), filename='queue', xlabel='Step (x%i)' % QueueSeries.windows.window, ylabel='Queue lenght (vehicles)')
+    else:
+        Visualization.save_data_and_plot(data=Simulation.queue_length_episode, filename='queue', xlabel='Step', ylabel='Queue lenght (vehicles)')
+
+    Visualization.wait()
@@ -1,6 +1,7 @@
 import traci
 import numpy as np
 import random
+import time
 import timeit
 
 # Phase codes based on baneswor_final.net.xml
@@ -12,18 +13,35 @@ PHASE_3 = 3  # action 3 - phase 3 (duration 95s in default)
 
 
 class Simulation:
-    def __init__(self, Model, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, num_actions):
+    def __init__(self, Model, TrafficGen, Sumo, max_steps, green_duration, yellow_duration, num_states, num_actions, idle_fast_forward=False, StateEncoder=None,
+                 decision_mode='fixed', min_green=10, max_green=60, queue_threshold=5, Shadow=None,
+                 record_every=0, QueueSeries=None, StopLines=None):
         self._Model = Model
         self._TrafficGen = TrafficGen
         self._step = 0
-        self._sumo_cmd = sumo_cmd
+        self._Sumo = Sumo
         self._max_steps = max_steps
         self._green_duration = green_duration
         self._yellow_duration = yellow_duration
         self._num_states = num_states
         self._num_actions = num_actions
         self._reward_episode = []
-        self._queue_length_episode = []
+        self._queue_length_episode = QueueSeries if QueueSeries is not None else []  # a StreamingSeries keeps constant memory
+        self._decision_times = []  # seconds spent reading the state and choosing the action, for every decision
+        self._decision_vehicles = []  # vehicles in the network at every decision
+        self._idle_fast_forward = idle_fast_forward
+        self._StateEncoder = StateEncoder  # None: the state is built from the position of every car
+        self._decision_mode = decision_mode  # fixed: decide every green_duration, event: decide when a trigger fires
+        self._min_green = min_green
+        self._max_green = max_green
+        self._queue_threshold = queue_threshold
+        self._edge_queues = (0, 0, 0, 0)  # halting cars of every incoming road at the last step
+        self._StopLines = StopLines  # None, or the stop line detectors of the detector activation trigger
+        self._cpu_time = 0
+        self._Shadow = Shadow  # None, or policies computing their decisions on the same states without actuating J1
+        self._q_values = None  # action values of the last decision
+        self._record_every = record_every  # 0: off, n: save the state every n steps, for offline evaluation
+        self._recorded_states = []
 
 
     def run(self, episode):
@@ -31,21 +49,36 @@ class Simulation:
         Runs the testing simulation
         """
         start_time = timeit.default_timer()
+        start_cpu_time = time.process_time()
 
         # first, generate the route file for this simulation and set up sumo
         self._TrafficGen.generate_routefile(seed=episode)
-        traci.start(self._sumo_cmd)
+        self._start_step = self._Sumo.start_episode()  # 0, or the warm start step
+        if self._StateEncoder is not None:
+            self._StateEncoder.subscribe()
+        if self._StopLines is not None:
+            self._StopLines.subscribe()
         print("Simulating...")
 
         # inits
-        self._step = 0
+        self._step = self._start_step
         self._waiting_times = {}
-        old_total_wait = 0
+        old_total_wait = self._collect_waiting_times()  # 0 on an empty network, the waiting time so far after a warm start
         old_action = -1  # dummy init
+        self._get_queue_length()  # queues at the first decision, for the event triggers
 
         while self._step < self._max_steps:
 
+            # with an empty network, jump to the next departure or end the episode, padding the queue with the 0s of the skipped steps
+            if self._idle_fast_forward:
+                idle_until = self._Sumo.fast_forward_idle(self._step, self._max_steps, self._TrafficGen.next_departure(self._step))
+                self._queue_length_episode.extend([0] * (idle_until - self._step))
+                self._step = idle_until
+                if self._step >= self._max_steps:
+                    break
+
             # get current state of the intersection
+            decision_start = timeit.default_timer()
             current_state = self._get_state()
 
             # calculate reward of previous action: (change in cumulative waiting time between actions)
@@ -55,15 +88,22 @@ class Simulation:
 
             # choose the light phase to activate, based on the current state of the intersection
             action = self._choose_action(current_state)
+            self._decision_times.append(timeit.default_timer() - decision_start)
+            self._decision_vehicles.append(traci.vehicle.getIDCount())
+            if self._Shadow is not None:
+                self._Shadow.record(current_state, self._q_values, action)
 
             # if the chosen phase is different from the last phase, activate the yellow phase
-            if self._step != 0 and old_action != action:
+            if old_action not in (-1, action):
                 self._set_yellow_phase(old_action)
                 self._simulate(self._yellow_duration)
 
             # execute the phase selected before
             self._set_green_phase(action)
-            self._simulate(self._green_duration)
+            if self._decision_mode == 'event':
+                self._simulate_until_trigger()
+            else:
+                self._simulate(self._green_duration)
 
             # saving variables for later & accumulate reward
             old_action = action
@@ -72,8 +112,9 @@ class Simulation:
             self._reward_episode.append(reward)
 
         #print("Total reward:", np.sum(self._reward_episode))
-        traci.close()
+        self._Sumo.end_episode()
         simulation_time = round(timeit.default_timer() - start_time, 1)
+        self._cpu_time = time.process_time() - start_cpu_time  # cpu of the controller process, sumo runs in its own
 
         return simulation_time
 
@@ -91,6 +132,31 @@ class Simulation:
             steps_todo -= 1
             queue_length = self._get_queue_length()
             self._queue_length_episode.append(queue_length)
+            if self._record_every and self._step % self._record_every == 0:
+                self._recorded_states.append(self._get_state())
+
+
+    def _simulate_until_trigger(self):
+        """
+        Keep the current green until a cheap per-step trigger asks for a new decision: the green lasted max_green, or it
+        lasted min_green and either the queue of an incoming road grew by queue_threshold cars since the decision, or (with
+        the stop line detectors) a car reached the stop line of a red lane that was empty at the decision.
+        The queues are the ones read at every step for the stats anyway and the detectors come with the subscriptions,
+        so no TraCI call is added per step
+        """
+        queues_at_decision = self._edge_queues
+        if self._StopLines is not None:
+            self._StopLines.start_green()
+        green_time = 0
+        while self._step < self._max_steps:
+            self._simulate(1)
+            green_time += 1
+            if green_time >= self._max_green:
+                return
+            if green_time >= self._min_green and any(queue - queue_before >= self._queue_threshold for queue, queue_before in zip(self._edge_queues, queues_at_decision)):
+                return
+            if green_time >= self._min_green and self._StopLines is not None and self._StopLines.activated():
+                return
 
 
     def _collect_waiting_times(self):
@@ -116,7 +182,8 @@ class Simulation:
         """
         Pick the best action known based on the current state of the env
         """
-        return np.argmax(self._Model.predict_one(state))
+        self._q_values = self._Model.predict_one(state)
+        return np.argmax(self._q_values)
 
 
     def _set_yellow_phase(self, old_action):
@@ -155,6 +222,7 @@ class Simulation:
         halt_RU1 = traci.edge.getLastStepHaltingNumber("RU1")
         halt_UL2 = traci.edge.getLastStepHaltingNumber("UL2")
         halt_LD1 = traci.edge.getLastStepHaltingNumber("LD1")
+        self._edge_queues = (halt_DR2, halt_RU1, halt_UL2, halt_LD1)
         queue_length = halt_DR2 + halt_RU1 + halt_UL2 + halt_LD1
         return queue_length
 
@@ -171,7 +239,12 @@ class Simulation:
         - LD1: 5 lanes (LD1_0, LD1_1, LD1_2, LD1_3, LD1_4)
         
         We'll map these to 8 lane groups to maintain 80 states (8 groups × 10 cells)
+
+        With a detector state encoder, the same state is read from the lane area detectors of the cells instead
         """
+        if self._StateEncoder is not None:
+            return self._StateEncoder.get_state()
+
         state = np.zeros(self._num_states)
         car_list = traci.vehicle.getIDList()
 
@@ -251,4 +324,24 @@ class Simulation:
         return self._reward_episode
 
 
+    @property
+    def decision_times(self):
+        return self._decision_times
+
+
+    @property
+    def decision_vehicles(self):
+        return self._decision_vehicles
+
+
+    @property
+    def cpu_time(self):
+        return self._cpu_time
+
+
+    @property
+    def recorded_states(self):
+        return self._recorded_states
+
+
 
@@ -2,22 +2,36 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import sys
 import datetime
 from shutil import copyfile
 
 from training_simulation import Simulation
 from generator import TrafficGenerator
+from sumo_session import SumoSession
+from snapshots import SnapshotCache
+from detectors import DetectorStateEncoder, DETECTORS_FILE
 from memory import Memory
+from replay_scheduler import ReplayScheduler
 from model import TrainModel
 from visualization import Visualization
 from utils import import_train_configuration, set_sumo, set_train_path
+from registry import RunRegistry
+from live_metrics import LiveMetrics, TraciCallCounter
 
 
 if __name__ == "__main__":
 
-    config = import_train_configuration(config_file='training_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+    config_file = sys.argv[1] if len(sys.argv) > 1 else 'training_settings.ini'  # e.g. a trial config written by sweep.py
+    config = import_train_configuration(config_file=config_file)
+    StateEncoder = None
+    if config['state_encoder'] == 'detectors':
+        StateEncoder = DetectorStateEncoder(config['num_states'], os.path.join('intersection', config['sumocfg_file_name']))
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], config['route_file_name'],
+                        additional_files=[DETECTORS_FILE] if StateEncoder is not None else None)
     path = set_train_path(config['models_path_name'])
+    Registry = RunRegistry()
+    run_id = Registry.register_run(path, config)
 
     Model = TrainModel(
         config['num_layers'], 
@@ -25,7 +39,10 @@ if __name__ == "__main__":
         config['batch_size'], 
         config['learning_rate'], 
         input_dim=config['num_states'], 
-        output_dim=config['num_actions']
+        output_dim=config['num_actions'],
+        q_cache_size=config['q_cache_size'],
+        sparse_input=config['sparse_input'],
+        dueling=config['dueling']
     )
 
     Memory = Memory(
@@ -35,46 +52,137 @@ if __name__ == "__main__":
 
     TrafficGen = TrafficGenerator(
         config['max_steps'], 
-        config['n_cars_generated']
+        config['n_cars_generated'],
+        route_file=os.path.join('intersection', config['route_file_name'])
     )
 
+    Snapshots = SnapshotCache(
+        os.path.join('intersection', 'snapshots'),
+        config['snapshot_cache_size']
+    )
+
+    Sumo = SumoSession(
+        sumo_cmd,
+        persistent=config['persistent_sumo'],
+        Snapshots=Snapshots,
+        warm_start_step=config['warm_start_step']
+    )
+
+    Scheduler = None
+    if config['replay_schedule'] == 'adaptive':
+        Scheduler = ReplayScheduler(
+            config['batch_size'],
+            config['training_epochs'],
+            config['replay_ratio'],
+            config['replay_max_passes'],
+            config['plateau_tolerance'],
+            config['plateau_chunk'],
+            patience=config['plateau_patience'],
+            smoothing=config['plateau_smoothing']
+        )
+
     Visualization = Visualization(
         path, 
-        dpi=96
+        dpi=96,
+        plot_mode=config['plot_mode'],
+        max_points=config['plot_max_points']
     )
         
     Simulation = Simulation(
         Model,
         Memory,
         TrafficGen,
-        sumo_cmd,
+        Sumo,
         config['gamma'],
         config['max_steps'],
         config['green_duration'],
         config['yellow_duration'],
         config['num_states'],
         config['num_actions'],
-        config['training_epochs']
+        config['training_epochs'],
+        idle_fast_forward=config['idle_fast_forward'],
+        StateEncoder=StateEncoder,
+        replay_mode=config['replay_mode'],
+        Scheduler=Scheduler,
+        n_step=config['n_step']
     )
     
+    Metrics = None
+    if config['metrics_port'] or config['metrics_log']:
+        Metrics = LiveMetrics(port=config['metrics_port'], log_file=os.path.join(path, 'metrics.jsonl') if config['metrics_log'] else None)
+        TraciCalls = TraciCallCounter()
+        TraciCalls.install()
+        if config['metrics_port']:
+            print('Live metrics at http://127.0.0.1:%i/metrics' % config['metrics_port'])
+
     episode = 0
+    total_training_time = 0
     timestamp_start = datetime.datetime.now()
+
+    # per-episode stats, written while the training goes on (read by sweep.py for early stopping)
+    with open(os.path.join(path, 'progress.txt'), "w") as file:
+        file.write("episode\treward\tdelay\tqueue\tsimulation_time\ttraining_time\tsumo_startup_time\ttraining_batches\ttraining_loss\n")
     
     while episode < config['total_episodes']:
         print('\n----- Episode', str(episode+1), 'of', str(config['total_episodes']))
         epsilon = 1.0 - (episode / config['total_episodes'])  # set the epsilon for this episode according to epsilon-greedy policy
+        traci_calls = TraciCalls.calls if Metrics is not None else 0
         simulation_time, training_time = Simulation.run(episode, epsilon)  # run the simulation
         print('Simulation time:', simulation_time, 's - Training time:', training_time, 's - Total:', round(simulation_time+training_time, 1), 's')
+        if training_time > 0:
+            print('Training throughput: %.0f samples/s' % (Simulation.training_samples / training_time))
+        print('Training batches:', Simulation.training_batches, '- Loss:', Simulation.training_loss)
+        total_training_time += training_time
+        if Model.q_cache is not None:
+            print('Q-value cache: %i hits, %i misses (hit rate %.1f%%)' % (Model.q_cache.hits, Model.q_cache.misses, Model.q_cache.hit_rate * 100))
+        print('SUMO startup: %.3f s - saved vs a fresh start: %.3f s' % (Sumo.last_startup_time, Sumo.fresh_startup_time - Sumo.last_startup_time))
+        with open(os.path.join(path, 'progress.txt'), "a") as file:
+            file.write("%i\t%s\t%s\t%s\t%s\t%s\t%.3f\t%i\t%s\n" % (episode+1, Simulation.reward_store[-1], Simulation.cumulative_wait_store[-1], Simulation.avg_queue_length_store[-1],
+                                                                 simulation_time, training_time, Sumo.last_startup_time, Simulation.training_batches, Simulation.training_loss))
+        if Metrics is not None:
+            Metrics.update(
+                episode=episode+1,
+                total_episodes=config['total_episodes'],
+                epsilon=epsilon,
+                reward=Simulation.reward_store[-1],
+                delay=Simulation.cumulative_wait_store[-1],
+                queue=Simulation.avg_queue_length_store[-1],
+                replay_size=Memory.size,
+                simulation_time=simulation_time,
+                training_time=training_time,
+                training_batches=Simulation.training_batches,
+                training_loss=Simulation.training_loss,
+                training_samples_per_second=Simulation.training_samples / training_time if training_time > 0 else 0,
+                traci_calls=TraciCalls.calls,
+                traci_calls_per_second=(TraciCalls.calls - traci_calls) / simulation_time if simulation_time > 0 else 0
+            )
         episode += 1
 
+    Sumo.close()
+    if Metrics is not None:
+        Metrics.close()
+        TraciCalls.uninstall()
+
     print("\n----- Start time:", timestamp_start)
     print("----- End time:", datetime.datetime.now())
+    print("----- Total training time: %.1f s" % total_training_time)
     print("----- Session info saved at:", path)
 
     Model.save_model(path)
 
-    copyfile(src='training_settings.ini', dst=os.path.join(path, 'training_settings.ini'))
+    copyfile(src=config_file, dst=os.path.join(path, 'training_settings.ini'))
+
+    Registry.update_run(
+        run_id,
+        'completed',
+        episodes=episode,
+        final_reward=Simulation.reward_store[-1],
+        final_delay=Simulation.cumulative_wait_store[-1],
+        final_queue=Simulation.avg_queue_length_store[-1],
+        training_time=total_training_time
+    )
 
     Visualization.save_data_and_plot(data=Simulation.reward_store, filename='reward', xlabel='Episode', ylabel='Cumulative negative reward')
     Visualization.save_data_and_plot(data=Simulation.cumulative_wait_store, filename='delay', xlabel='Episode', ylabel='Cumulative delay (s)')
-    Visualization.save_data_and_plot(data=Simulation.avg_queue_length_store, filename='queue', xlabel='Episode', ylabel='Average queue length (vehicles)')
\ No newline at end of file
+    Visualization.save_data_and_plot(data=Simulation.avg_queue_length_store, filename='queue', xlabel='Episode', ylabel='Average queue length (vehicles)')
+    Visualization.wait()
@@ -3,6 +3,8 @@ import numpy as np
 import random
 import timeit
 
+from memory import n_step_samples
+
 # Phase codes based on baneswor_final.net.xml
 # Your network has 4 phases in the tlLogic, we'll map actions to these phases
 PHASE_0 = 0  # action 0 - phase 0 (duration 45s in default)
@@ -12,13 +14,13 @@ PHASE_3 = 3  # action 3 - phase 3 (duration 95s in default)
 
 
 class Simulation:
-    def __init__(self, Model, Memory, TrafficGen, sumo_cmd, gamma, max_steps, green_duration, yellow_duration, num_states, num_actions, training_epochs):
+    def __init__(self, Model, Memory, TrafficGen, Sumo, gamma, max_steps, green_duration, yellow_duration, num_states, num_actions, training_epochs, idle_fast_forward=False, StateEncoder=None, replay_mode='per_batch', Scheduler=None, n_step=1):
         self._Model = Model
         self._Memory = Memory
         self._TrafficGen = TrafficGen
         self._gamma = gamma
         self._step = 0
-        self._sumo_cmd = sumo_cmd
+        self._Sumo = Sumo
         self._max_steps = max_steps
         self._green_duration = green_duration
         self._yellow_duration = yellow_duration
@@ -28,6 +30,14 @@ class Simulation:
         self._cumulative_wait_store = []
         self._avg_queue_length_store = []
         self._training_epochs = training_epochs
+        self._idle_fast_forward = idle_fast_forward
+        self._StateEncoder = StateEncoder  # None: the state is built from the position of every car
+        self._replay_mode = replay_mode
+        self._Scheduler = Scheduler  # None: training_epochs batches every episode
+        self._training_samples = 0
+        self._training_batches = 0
+        self._training_loss = None
+        self._n_step = n_step  # 1: one-step targets, n: n-step returns computed at the end of the episode
 
 
     def run(self, episode, epsilon):
@@ -38,21 +48,31 @@ class Simulation:
 
         # first, generate the route file for this simulation and set up sumo
         self._TrafficGen.generate_routefile(seed=episode)
-        traci.start(self._sumo_cmd)
+        self._start_step = self._Sumo.start_episode()  # 0, or the warm start step
+        if self._StateEncoder is not None:
+            self._StateEncoder.subscribe()
         print("Simulating...")
 
         # inits
-        self._step = 0
+        self._step = self._start_step
         self._waiting_times = {}
         self._sum_neg_reward = 0
         self._sum_queue_length = 0
         self._sum_waiting_time = 0
-        old_total_wait = 0
+        old_total_wait = self._collect_waiting_times()  # 0 on an empty network, the waiting time so far after a warm start
         old_state = -1
         old_action = -1
+        new_samples = 0
+        episode_samples = []  # n-step: the samples of the episode, in order
 
         while self._step < self._max_steps:
 
+            # with an empty network, jump to the next departure or end the episode: the skipped steps have 0 queue, so the stats don't change
+            if self._idle_fast_forward:
+                self._step = self._Sumo.fast_forward_idle(self._step, self._max_steps, self._TrafficGen.next_departure(self._step))
+                if self._step >= self._max_steps:
+                    break
+
             # get current state of the intersection
             current_state = self._get_state()
 
@@ -62,14 +82,18 @@ class Simulation:
             reward = old_total_wait - current_total_wait
 
             # saving the data into the memory
-            if self._step != 0:
-                self._Memory.add_sample((old_state, old_action, reward, current_state))
+            if old_action != -1:  # not the first decision: the idle fast forward can move it past the start step
+                if self._n_step > 1:
+                    episode_samples.append((old_state, old_action, reward, current_state))
+                else:
+                    self._Memory.add_sample((old_state, old_action, reward, current_state))
+                new_samples += 1
 
             # choose the light phase to activate, based on the current state of the intersection
             action = self._choose_action(current_state, epsilon)
 
             # if the chosen phase is different from the last phase, activate the yellow phase
-            if self._step != 0 and old_action != action:
+            if old_action not in (-1, action):
                 self._set_yellow_phase(old_action)
                 self._simulate(self._yellow_duration)
 
@@ -86,15 +110,18 @@ class Simulation:
             if reward < 0:
                 self._sum_neg_reward += reward
 
+        if episode_samples:
+            for sample in n_step_samples(episode_samples, self._gamma, self._n_step):
+                self._Memory.add_sample(sample)
+
         self._save_episode_stats()
         print("Total reward:", self._sum_neg_reward, "- Epsilon:", round(epsilon, 2))
-        traci.close()
+        self._Sumo.end_episode()
         simulation_time = round(timeit.default_timer() - start_time, 1)
 
         print("Training...")
         start_time = timeit.default_timer()
-        for _ in range(self._training_epochs):
-            self._replay()
+        self._train(new_samples)
         training_time = round(timeit.default_timer() - start_time, 1)
 
         return simulation_time, training_time
@@ -197,7 +224,12 @@ class Simulation:
         - LD1: 5 lanes (LD1_0, LD1_1, LD1_2, LD1_3, LD1_4)
         
         We'll map these to 8 lane groups to maintain 80 states (8 groups × 10 cells)
+
+        With a detector state encoder, the same state is read from the lane area detectors of the cells instead
         """
+        if self._StateEncoder is not None:
+            return self._StateEncoder.get_state()
+
         state = np.zeros(self._num_states)
         car_list = traci.vehicle.getIDList()
 
@@ -267,9 +299,45 @@ class Simulation:
         return state
 
 
+    def _train(self, new_samples):
+        """
+        Train at the end of the episode: training_epochs batches, or with a scheduler as many batches as it plans for
+        the new samples and the memory size, in chunks, stopping early when the loss stops improving
+        """
+        if self._Scheduler is None:
+            self._training_batches, self._training_samples, self._training_loss = self._replay_batches(self._training_epochs)
+            return
+
+        self._training_batches, self._training_samples, self._training_loss = 0, 0, None
+        self._Scheduler.start_episode()
+        for n_batches in self._Scheduler.chunks(self._Scheduler.plan(new_samples, self._Memory.size)):
+            trained_batches, samples, loss = self._replay_batches(n_batches)
+            if loss is None:  # the memory is not full enough
+                return
+            self._training_batches += trained_batches
+            self._training_samples += samples
+            self._training_loss = loss
+            if self._Scheduler.plateau(loss):
+                print("Loss plateau after", self._training_batches, "batches")
+                return
+
+
+    def _replay_batches(self, n_batches):
+        """
+        Train on n_batches batches with the replay mode of the simulation, return the batches, samples and mean loss
+        """
+        if self._replay_mode == 'dataset':
+            samples, loss = self._replay_dataset(n_batches)
+            return (n_batches if loss is not None else 0), samples, loss
+        results = [self._replay() for _ in range(n_batches)]
+        losses = [loss for _, loss in results if loss is not None]
+        return len(losses), sum(samples for samples, _ in results), float(np.mean(losses)) if losses else None
+
+
     def _replay(self):
         """
-        Retrieve a group of samples from the memory and for each of them update the learning equation, then train
+        Retrieve a group of samples from the memory and for each of them update the learning equation, then train.
+        Return the number of samples and the loss (None if the memory is not full enough)
         """
         batch = self._Memory.get_samples(self._Model.batch_size)
 
@@ -280,6 +348,7 @@ class Simulation:
             # prediction
             q_s_a = self._Model.predict_batch(states)  # predict Q(state), for every sample
             q_s_a_d = self._Model.predict_batch(next_states)  # predict Q(next_state), for every sample
+            discounts = [val[4] if len(val) > 4 else self._gamma for val in batch]  # gamma^n for the n-step samples
 
             # setup training arrays
             x = np.zeros((len(batch), self._num_states))
@@ -288,11 +357,33 @@ class Simulation:
             for i, b in enumerate(batch):
                 state, action, reward, _ = b[0], b[1], b[2], b[3]  # extract data from one sample
                 current_q = q_s_a[i]  # get the Q(state) predicted before
-                current_q[action] = reward + self._gamma * np.amax(q_s_a_d[i])  # update Q(state, action)
+                current_q[action] = reward + discounts[i] * np.amax(q_s_a_d[i])  # update Q(state, action)
                 x[i] = state
                 y[i] = current_q  # Q(state) that includes the updated action value
 
-            self._Model.train_batch(x, y)  # train the NN
+            return len(batch), self._Model.train_batch(x, y)  # train the NN
+        return 0, None
+
+
+    def _replay_dataset(self, n_batches):
+        """
+        Draw n_batches batches at once (random samples without replacement in each batch, like Memory.get_samples) and
+        train on them in a single pass, the targets being computed by the model. Return the number of samples and the loss
+        """
+        samples = self._Memory.get_all_samples()
+        if len(samples) == 0:  # the memory is not full enough
+            return 0, None
+
+        batch_size = min(self._Model.batch_size, len(samples))
+        batch_indices = np.array([random.sample(range(len(samples)), batch_size) for _ in range(n_batches)])
+        states = np.array([val[0] for val in samples])
+        actions = np.array([val[1] for val in samples])
+        rewards = np.array([val[2] for val in samples])
+        next_states = np.array([val[3] for val in samples])
+        discounts = np.array([val[4] if len(val) > 4 else self._gamma for val in samples])
+
+        loss = self._Model.train_replay(states, actions, rewards, next_states, discounts, batch_indices)
+        return batch_indices.size, loss
 
 
     def _save_episode_stats(self):
@@ -301,7 +392,22 @@ class Simulation:
         """
         self._reward_store.append(self._sum_neg_reward)  # how much negative reward in this episode
         self._cumulative_wait_store.append(self._sum_waiting_time)  # total number of seconds waited by cars in this episode
-        self._avg_queue_length_store.append(self._sum_queue_length / self._max_steps)  # average number of queued cars per step, in this episode
+        self._avg_queue_length_store.append(self._sum_queue_length / (self._max_steps - self._start_step))  # average number of queued cars per step, in this episode
+
+
+    @property
+    def training_samples(self):
+        return self._training_samples
+
+
+    @property
+    def training_batches(self):
+        return self._training_batches
+
+
+    @property
+    def training_loss(self):
+        return self._training_loss
 
 
     @property
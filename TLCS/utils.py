@@ -1,6 +1,6 @@
 import configparser
-from sumolib import checkBinary
 import os
+import re
 import sys
 
 
@@ -17,18 +17,40 @@ def import_train_configuration(config_file):
     config['n_cars_generated'] = content['simulation'].getint('n_cars_generated')
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
+    config['persistent_sumo'] = content['simulation'].getboolean('persistent_sumo', fallback=True)
+    config['warm_start_step'] = content['simulation'].getint('warm_start_step', fallback=0)
+    config['idle_fast_forward'] = content['simulation'].getboolean('idle_fast_forward', fallback=False)
+    config['snapshot_cache_size'] = content['simulation'].getint('snapshot_cache_size', fallback=50)
     config['num_layers'] = content['model'].getint('num_layers')
     config['width_layers'] = content['model'].getint('width_layers')
     config['batch_size'] = content['model'].getint('batch_size')
     config['learning_rate'] = content['model'].getfloat('learning_rate')
     config['training_epochs'] = content['model'].getint('training_epochs')
+    config['sparse_input'] = content['model'].getboolean('sparse_input', fallback=False)
+    config['dueling'] = content['model'].getboolean('dueling', fallback=False)
+    config['replay_mode'] = content['model'].get('replay_mode', fallback='per_batch')
+    config['replay_schedule'] = content['model'].get('replay_schedule', fallback='fixed')
+    config['replay_ratio'] = content['model'].getfloat('replay_ratio', fallback=256)
+    config['replay_max_passes'] = content['model'].getfloat('replay_max_passes', fallback=4)
+    config['plateau_tolerance'] = content['model'].getfloat('plateau_tolerance', fallback=0.01)
+    config['plateau_chunk'] = content['model'].getint('plateau_chunk', fallback=100)
+    config['plateau_patience'] = content['model'].getint('plateau_patience', fallback=3)
+    config['plateau_smoothing'] = content['model'].getfloat('plateau_smoothing', fallback=0.7)
     config['memory_size_min'] = content['memory'].getint('memory_size_min')
     config['memory_size_max'] = content['memory'].getint('memory_size_max')
     config['num_states'] = content['agent'].getint('num_states')
     config['num_actions'] = content['agent'].getint('num_actions')
     config['gamma'] = content['agent'].getfloat('gamma')
+    config['n_step'] = content['agent'].getint('n_step', fallback=1)
+    config['q_cache_size'] = content['agent'].getint('q_cache_size', fallback=0)
+    config['state_encoder'] = content['agent'].get('state_encoder', fallback='vehicles')
     config['models_path_name'] = content['dir']['models_path_name']
     config['sumocfg_file_name'] = content['dir']['sumocfg_file_name']
+    config['route_file_name'] = content['dir'].get('route_file_name', 'episode_routes.rou.xml')
+    config['plot_mode'] = content.get('visualization', 'plot_mode', fallback='sync')
+    config['plot_max_points'] = content.getint('visualization', 'plot_max_points', fallback=2000)
+    config['metrics_port'] = content.getint('visualization', 'metrics_port', fallback=0)
+    config['metrics_log'] = content.getboolean('visualization', 'metrics_log', fallback=False)
     return config
 
 
@@ -45,17 +67,36 @@ def import_test_configuration(config_file):
     config['episode_seed'] = content['simulation'].getint('episode_seed')
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
+    config['warm_start_step'] = content['simulation'].getint('warm_start_step', fallback=0)
+    config['idle_fast_forward'] = content['simulation'].getboolean('idle_fast_forward', fallback=False)
+    config['snapshot_cache_size'] = content['simulation'].getint('snapshot_cache_size', fallback=50)
+    config['decision_mode'] = content['simulation'].get('decision_mode', fallback='fixed')
+    config['min_green'] = content['simulation'].getint('min_green', fallback=10)
+    config['max_green'] = content['simulation'].getint('max_green', fallback=60)
+    config['queue_threshold'] = content['simulation'].getint('queue_threshold', fallback=5)
+    config['detector_trigger'] = content['simulation'].getboolean('detector_trigger', fallback=False)
+    config['streaming_metrics'] = content['simulation'].getboolean('streaming_metrics', fallback=False)
+    config['metrics_max_points'] = content['simulation'].getint('metrics_max_points', fallback=2000)
+    config['full_resolution'] = content['simulation'].getboolean('full_resolution', fallback=False)
+    config['sparse_input'] = content.getboolean('model', 'sparse_input', fallback=False)  # [model], as in the training settings
     config['num_states'] = content['agent'].getint('num_states')
     config['num_actions'] = content['agent'].getint('num_actions')
+    config['q_cache_size'] = content['agent'].getint('q_cache_size', fallback=0)
+    config['state_encoder'] = content['agent'].get('state_encoder', fallback='vehicles')
+    config['backend'] = content['agent'].get('backend', fallback='network')
+    config['shadow_models'] = [int(model_n) for model_n in content['agent'].get('shadow_models', fallback='').split(',') if model_n.strip()]
     config['sumocfg_file_name'] = content['dir']['sumocfg_file_name']
     config['models_path_name'] = content['dir']['models_path_name']
     config['model_to_test'] = content['dir'].getint('model_to_test') 
+    config['route_file_name'] = content['dir'].get('route_file_name', 'episode_routes.rou.xml')
+    config['plot_mode'] = content.get('visualization', 'plot_mode', fallback='sync')
+    config['plot_max_points'] = content.getint('visualization', 'plot_max_points', fallback=2000)
     return config
 
 
-def set_sumo(gui, sumocfg_file_name, max_steps):
+def set_sumo(gui, sumocfg_file_name, max_steps, route_file_name=None, additional_files=None):
     """
-    Configure various parameters of SUMO
+    Configure various parameters of SUMO, optionally overriding the route file of the .sumocfg file and adding additional files
     """
     # sumo things - we need to import python modules from the $SUMO_HOME/tools directory
     if 'SUMO_HOME' in os.environ:
@@ -63,6 +104,7 @@ def set_sumo(gui, sumocfg_file_name, max_steps):
         sys.path.append(tools)
     else:
         sys.exit("please declare environment variable 'SUMO_HOME'")
+    from sumolib import checkBinary  # imported here, once the SUMO tools are on the path
 
     # setting the cmd mode or the visual mode    
     if gui == False:
@@ -72,27 +114,33 @@ def set_sumo(gui, sumocfg_file_name, max_steps):
  
     # setting the cmd command to run sumo at simulation time
     sumo_cmd = [sumoBinary, "-c", os.path.join('intersection', sumocfg_file_name), "--no-step-log", "true", "--waiting-time-memory", str(max_steps)]
+    if route_file_name is not None:
+        sumo_cmd += ["-r", os.path.join('intersection', route_file_name)]
+    if additional_files:
+        sumo_cmd += ["--additional-files", ",".join(additional_files)]
 
     return sumo_cmd
 
 
 def set_train_path(models_path_name):
     """
-    Create a new model path with an incremental integer, also considering previously created model paths
+    Create a new model path with an incremental integer, also considering previously created model paths.
+    The folder is claimed with os.mkdir, which fails if it already exists: trainings started at the same time never share a folder
     """
     models_path = os.path.join(os.getcwd(), models_path_name, '')
     os.makedirs(os.path.dirname(models_path), exist_ok=True)
 
-    dir_content = os.listdir(models_path)
-    if dir_content:
-        previous_versions = [int(name.split("_")[1]) for name in dir_content]
-        new_version = str(max(previous_versions) + 1)
-    else:
-        new_version = '1'
+    while True:
+        dir_content = os.listdir(models_path)
+        previous_versions = [int(name.split("_")[1]) for name in dir_content if re.fullmatch(r'model_\d+', name)]  # skip files and other folders
+        new_version = str(max(previous_versions, default=0) + 1)
 
-    data_path = os.path.join(models_path, 'model_'+new_version, '')
-    os.makedirs(os.path.dirname(data_path), exist_ok=True)
-    return data_path 
+        data_path = os.path.join(models_path, 'model_'+new_version, '')
+        try:
+            os.mkdir(os.path.dirname(data_path))
+            return data_path
+        except FileExistsError:
+            continue  # another training claimed this version in the meantime, try the next one
 
 
 def set_test_path(models_path_name, model_n):
@@ -1,32 +1,136 @@
-import matplotlib.pyplot as plt
 import os
+import sys
+import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# plot modes: 'sync' renders every plot immediately, 'background' renders the plots in a pool of worker processes
+# while the run goes on, 'data_only' only saves the data (plots can be rendered later with: python visualization.py folder)
+PLOT_MODES = ('sync', 'background', 'data_only')
+
 
 class Visualization:
-    def __init__(self, path, dpi):
+    def __init__(self, path, dpi, plot_mode='sync', max_points=2000):
+            if plot_mode not in PLOT_MODES:
+                sys.exit("plot_mode must be one of: " + ", ".join(PLOT_MODES))
             self._path = path
             self._dpi = dpi
+            self._plot_mode = plot_mode
+            self._max_points = max_points
+            self._executor = None
+            self._pending = []
 
 
     def save_data_and_plot(self, data, filename, xlabel, ylabel):
         """
-        Produce a plot of performance of the agent over the session and save the relative data to txt
+        Save the data of the agent performance over the session to txt and produce the relative plot, according to the plot mode
         """
-        min_val = min(data)
-        max_val = max(data)
-
-        plt.rcParams.update({'font.size': 24})  # set bigger font size
-
-        plt.plot(data)
-        plt.ylabel(ylabel)
-        plt.xlabel(xlabel)
-        plt.margins(0)
-        plt.ylim(min_val - 0.05 * abs(min_val), max_val + 0.05 * abs(max_val))
-        fig = plt.gcf()
-        fig.set_size_inches(20, 11.25)
-        fig.savefig(os.path.join(self._path, 'plot_'+filename+'.png'), dpi=self._dpi)
-        plt.close("all")
-
-        with open(os.path.join(self._path, 'plot_'+filename + '_data.txt'), "w") as file:
+        data_file = os.path.join(self._path, 'plot_'+filename + '_data.txt')
+        plot_file = os.path.join(self._path, 'plot_'+filename+'.png')
+
+        with open(data_file, "w") as file:
             for value in data:
                     file.write("%s\n" % value)
-    
\ No newline at end of file
+
+        if self._plot_mode == 'sync':
+            render_plot(data, plot_file, xlabel, ylabel, self._dpi, self._max_points)
+        elif self._plot_mode == 'background':
+            if self._executor is None:
+                # spawn: the workers only import this module, not the tensorflow/traci state of the parent
+                self._executor = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1), mp_context=multiprocessing.get_context('spawn'))
+            self._pending.append(self._executor.submit(render_plot_from_file, data_file, plot_file, xlabel, ylabel, self._dpi, self._max_points))
+        else:
+            with open(os.path.join(self._path, 'plot_'+filename + '_labels.txt'), "w") as file:
+                file.write("%s\n%s\n" % (xlabel, ylabel))
+
+
+    def wait(self):
+        """
+        Wait until every plot rendered in background has been saved
+        """
+        for future in self._pending:
+            future.result()
+        self._pending = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def decimate(data, max_points):
+    """
+    Min/max decimation: split the series in max_points/2 buckets and keep the minimum and the maximum of each,
+    so the plotted envelope (spikes included) is preserved while the number of points stays bounded
+    """
+    y = np.asarray(data, dtype=float)
+    if max_points <= 0 or len(y) <= max_points:
+        return np.arange(len(y)), y
+
+    n_buckets = max(max_points // 2, 1)
+    bucket_size = -(-len(y) // n_buckets)  # ceil division
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:len(y)] = y
+    buckets = padded.reshape(n_buckets, bucket_size)
+    valid = ~np.all(np.isnan(buckets), axis=1)  # the last buckets can be padding only
+    buckets = buckets[valid]
+    offsets = np.flatnonzero(valid)[:, None] * bucket_size
+
+    extremes = np.stack([np.nanargmin(buckets, axis=1), np.nanargmax(buckets, axis=1)], axis=1)
+    x = np.sort(extremes, axis=1) + offsets  # keep the time order inside each bucket
+    x = x.ravel()
+    return x, y[x]
+
+
+def render_plot(data, plot_file, xlabel, ylabel, dpi, max_points=2000):
+    """
+    Render the plot of a data series to png with the Agg backend and an explicit figure (no pyplot global state)
+    """
+    import matplotlib  # imported here, matplotlib is slow to load and only needed at the end of a run
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    min_val = min(data)
+    max_val = max(data)
+    x, y = decimate(data, max_points)
+
+    with matplotlib.rc_context({'font.size': 24}):  # set bigger font size
+        fig = Figure(figsize=(20, 11.25))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.plot(x, y)
+        ax.set_ylabel(ylabel)
+        ax.set_xlabel(xlabel)
+        ax.margins(0)
+        ax.set_ylim(min_val - 0.05 * abs(min_val), max_val + 0.05 * abs(max_val))
+        fig.savefig(plot_file, dpi=dpi)
+
+
+def render_plot_from_file(data_file, plot_file, xlabel, ylabel, dpi, max_points=2000):
+    """
+    Render the plot of a data series saved to txt by save_data_and_plot
+    """
+    data = np.loadtxt(data_file, ndmin=1)
+    render_plot(data, plot_file, xlabel, ylabel, dpi, max_points)
+
+
+def render_saved_plots(path, dpi=96, max_points=2000):
+    """
+    Render the plots of every data series saved in 'data_only' mode in the folder, skipping the ones already rendered
+    """
+    for labels_file in sorted(glob.glob(os.path.join(path, 'plot_*_labels.txt'))):
+        prefix = labels_file[:-len('_labels.txt')]
+        plot_file = prefix + '.png'
+        if os.path.isfile(plot_file):
+            continue
+        with open(labels_file, 'r') as file:
+            xlabel, ylabel = file.read().splitlines()[:2]
+        render_plot_from_file(prefix + '_data.txt', plot_file, xlabel, ylabel, dpi, max_points)
+        print("Rendered:", plot_file)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python visualization.py folder [folder ...]")
+
+    for folder in sys.argv[1:]:
+        render_saved_plots(folder)